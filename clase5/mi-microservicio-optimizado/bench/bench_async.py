@@ -0,0 +1,45 @@
+"""Compara el servicio de productos síncrono (main:app) con el modo async (main_async:app)
+
+Uso:
+    docker compose --profile async up -d
+    python bench/bench_async.py --sync http://localhost:8002 --async http://localhost:8004
+"""
+import argparse
+import asyncio
+import json
+
+from carga import ejecutar_carga
+
+RUTAS = ["/api/productos", "/api/categorias", "/api/productos/1"]
+
+
+async def medir(base_url, total, concurrencia):
+    async def peticion(cliente, i):
+        return await cliente.get(base_url + RUTAS[i % len(RUTAS)])
+
+    # Calentar cache y pools antes de medir
+    await ejecutar_carga(peticion, len(RUTAS) * 10, len(RUTAS))
+    return await ejecutar_carga(peticion, total, concurrencia)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sync", default="http://localhost:8002", help="URL del servicio síncrono")
+    parser.add_argument("--async", dest="async_url", default="http://localhost:8004", help="URL del servicio async")
+    parser.add_argument("--total", type=int, default=5000, help="Peticiones por nivel de concurrencia")
+    parser.add_argument("--concurrencia", type=int, nargs="+", default=[10, 50, 100, 200])
+    args = parser.parse_args()
+
+    resultados = []
+    for concurrencia in args.concurrencia:
+        for modo, url in (("sync", args.sync), ("async", args.async_url)):
+            res = await medir(url, args.total, concurrencia)
+            res.update({"modo": modo, "concurrencia": concurrencia})
+            resultados.append(res)
+            print(f"{modo:5} c={concurrencia:<4} {res['rps']:>8} req/s  p50={res['p50_ms']}ms  p99={res['p99_ms']}ms  errores={res['errores']}")
+
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""Mide req/s del camino de acierto de cache (hit) en el servicio de productos
+
+Para comparar antes/después se ejecuta contra cada versión del servicio y se guardan los resultados:
+
+    python bench/bench_cache_hit.py --url http://localhost:8002 --etiqueta antes --salida antes.json
+    python bench/bench_cache_hit.py --url http://localhost:8002 --etiqueta despues --salida despues.json
+    python bench/bench_cache_hit.py --comparar antes.json despues.json
+"""
+import argparse
+import asyncio
+import json
+
+from carga import ejecutar_carga
+
+RUTAS = ["/api/productos", "/api/productos/1", "/api/categorias"]
+
+
+async def medir(base_url, total, concurrencia):
+    resultados = {}
+    for ruta in RUTAS:
+        async def peticion(cliente, i):
+            return await cliente.get(base_url + ruta)
+
+        # La primera ronda llena el cache; solo se mide con el cache caliente
+        await ejecutar_carga(peticion, 50, 5)
+        resultados[ruta] = await ejecutar_carga(peticion, total, concurrencia)
+        print(f"{ruta:20} {resultados[ruta]['rps']:>8} req/s  p50={resultados[ruta]['p50_ms']}ms  p99={resultados[ruta]['p99_ms']}ms")
+    return resultados
+
+
+def comparar(archivo_antes, archivo_despues):
+    with open(archivo_antes) as f:
+        antes = json.load(f)
+    with open(archivo_despues) as f:
+        despues = json.load(f)
+    print(f"{'ruta':20} {antes['etiqueta']:>10} {despues['etiqueta']:>10}   mejora")
+    for ruta, res in despues["rutas"].items():
+        base = antes["rutas"].get(ruta)
+        if not base:
+            continue
+        mejora = (res["rps"] / base["rps"] - 1) * 100 if base["rps"] else 0.0
+        print(f"{ruta:20} {base['rps']:>10} {res['rps']:>10}   {mejora:+.1f}%")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8002")
+    parser.add_argument("--total", type=int, default=5000)
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--etiqueta", default="actual")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTES", "DESPUES"))
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    resultado = {"etiqueta": args.etiqueta, "rutas": await medir(args.url, args.total, args.concurrencia)}
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultado, f, indent=2)
+    else:
+        print(json.dumps(resultado, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
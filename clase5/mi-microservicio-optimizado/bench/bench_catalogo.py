@@ -0,0 +1,109 @@
+"""Compara el filtrado del catálogo columnar en memoria contra la consulta a Postgres
+
+Se ejecuta en proceso (sin HTTP) para medir solo el costo de filtrar y ordenar:
+
+    python bench/bench_catalogo.py --dsn "host=localhost port=5432 dbname=tienda_hardware user=postgres password=postgres123"
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "service1"))
+from catalogo import CatalogoColumnar  # noqa: E402
+
+from carga import percentil  # noqa: E402
+
+# Combinaciones de filtros y orden que usa el frontend
+CONSULTAS = [
+    {"orden": "nombre"},
+    {"categoria": "Procesadores", "orden": "-precio"},
+    {"precio_min": 100, "precio_max": 500, "con_stock": True, "orden": "precio"},
+    {"marca": "AMD", "con_stock": True, "orden": "-stock"},
+]
+
+COLUMNAS_SQL = {"nombre": "nombre", "precio": "precio", "stock": "stock", "id": "id"}
+
+
+def consulta_sql(cur, categoria=None, marca=None, precio_min=None, precio_max=None,
+                 con_stock=False, orden="nombre", limite=50):
+    """Mismo filtro y orden resueltos por Postgres, como lo haría get_productos_from_db"""
+    condiciones, params = [], []
+    if categoria is not None:
+        condiciones.append("categoria = %s")
+        params.append(categoria)
+    if marca is not None:
+        condiciones.append("marca = %s")
+        params.append(marca)
+    if precio_min is not None:
+        condiciones.append("precio >= %s")
+        params.append(precio_min)
+    if precio_max is not None:
+        condiciones.append("precio <= %s")
+        params.append(precio_max)
+    if con_stock:
+        condiciones.append("stock > 0")
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    columna = COLUMNAS_SQL[orden.lstrip("-")]
+    direccion = "DESC" if orden.startswith("-") else "ASC"
+    cur.execute(
+        f"""
+        SELECT id, nombre, categoria, precio, stock, marca, count(*) OVER () AS total
+        FROM productos {where}
+        ORDER BY {columna} {direccion}, nombre, id
+        LIMIT %s
+        """,
+        params + [limite]
+    )
+    return cur.fetchall()
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        "p50_ms": round(percentil(tiempos, 50), 3),
+        "p95_ms": round(percentil(tiempos, 95), 3),
+        "p99_ms": round(percentil(tiempos, 99), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default="host=localhost port=5432 dbname=tienda_hardware user=postgres password=postgres123")
+    parser.add_argument("--repeticiones", type=int, default=500)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+
+    @contextmanager
+    def get_db_connection():
+        yield conn
+
+    catalogo = CatalogoColumnar(get_db_connection, intervalo=5)
+    inicio = time.perf_counter()
+    filas = catalogo.refrescar()
+    print(f"Carga inicial: {filas} filas en {(time.perf_counter() - inicio) * 1000:.1f}ms  {catalogo.stats()['bytes_columnas']} bytes")
+
+    resultados = []
+    with conn.cursor() as cur:
+        for filtros in CONSULTAS:
+            postgres = medir(lambda: consulta_sql(cur, **filtros), args.repeticiones)
+            memoria = medir(lambda: catalogo.consultar(**filtros), args.repeticiones)
+            resultados.append({"filtros": filtros, "postgres": postgres, "memoria": memoria})
+            print(f"{json.dumps(filtros):70} postgres p50={postgres['p50_ms']}ms  memoria p50={memoria['p50_ms']}ms")
+    conn.close()
+
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Prueba de contención del checkout: miles de pedidos concurrentes sobre pocos productos "calientes"
+
+Crea productos de prueba con stock conocido, dispara pedidos en paralelo contra
+POST /cart/pedidos y verifica al final que no hubo sobreventa (stock negativo o
+unidades vendidas mayores al stock inicial).
+
+Uso:
+    # Levantar backend_s2 con CHECKOUT_MODO_BLOQUEO=atomico, for_update o redis
+    python bench/bench_checkout.py --url http://localhost:8003 --pedidos 5000 --concurrencia 200
+
+Comparar el UPDATE directo contra la reserva en Redis:
+    CHECKOUT_MODO_BLOQUEO=atomico docker compose up -d backend_s2
+    python bench/bench_checkout.py --etiqueta atomico --salida atomico.json --limpiar
+    CHECKOUT_MODO_BLOQUEO=redis docker compose up -d backend_s2
+    python bench/bench_checkout.py --etiqueta redis --esperar 3 --salida redis.json --limpiar
+    python bench/bench_checkout.py --comparar atomico.json redis.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import psycopg2
+
+from carga import ejecutar_carga
+
+
+def crear_productos(conn, cantidad, stock):
+    """Inserta productos de prueba y devuelve sus ids"""
+    etiqueta = uuid.uuid4().hex[:8]
+    with conn.cursor() as cur:
+        ids = []
+        for i in range(cantidad):
+            cur.execute(
+                """
+                INSERT INTO productos (nombre, categoria, precio, stock, marca)
+                VALUES (%s, 'Benchmark', 10.00, %s, 'Benchmark')
+                RETURNING id
+                """,
+                (f"bench-hot-{etiqueta}-{i}", stock)
+            )
+            ids.append(cur.fetchone()[0])
+    conn.commit()
+    return ids
+
+
+def verificar(conn, ids, stock_inicial):
+    """Compara stock final con las unidades vendidas registradas en pedido_items"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT p.id, p.stock, COALESCE(SUM(pi.cantidad), 0)
+            FROM productos p
+            LEFT JOIN pedido_items pi ON pi.producto_id = p.id
+            WHERE p.id = ANY(%s)
+            GROUP BY p.id, p.stock
+            ORDER BY p.id
+            """,
+            (ids,)
+        )
+        filas = cur.fetchall()
+
+    productos = []
+    sobreventa = False
+    for producto_id, stock_final, vendidos in filas:
+        inconsistente = stock_final < 0 or vendidos > stock_inicial or stock_final != stock_inicial - vendidos
+        sobreventa = sobreventa or inconsistente
+        productos.append({
+            "producto_id": producto_id,
+            "stock_final": stock_final,
+            "vendidos": int(vendidos),
+            "inconsistente": inconsistente,
+        })
+    return sobreventa, productos
+
+
+def limpiar(conn, ids):
+    """Elimina los pedidos y productos creados por la prueba"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM pedidos WHERE id IN (SELECT pedido_id FROM pedido_items WHERE producto_id = ANY(%s))",
+            (ids,)
+        )
+        cur.execute("DELETE FROM productos WHERE id = ANY(%s)", (ids,))
+    conn.commit()
+
+
+def comparar(archivo_antes, archivo_despues):
+    with open(archivo_antes) as f:
+        antes = json.load(f)
+    with open(archivo_despues) as f:
+        despues = json.load(f)
+    print(f"{'métrica':20} {antes['etiqueta']:>10} {despues['etiqueta']:>10}")
+    for metrica in ("rps", "p50_ms", "p95_ms", "p99_ms", "pedidos_confirmados", "sobreventa"):
+        print(f"{metrica:20} {str(antes[metrica]):>10} {str(despues[metrica]):>10}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8003", help="URL del servicio de pedidos")
+    parser.add_argument("--dsn", default="host=localhost port=5432 dbname=tienda_hardware user=postgres password=postgres123")
+    parser.add_argument("--pedidos", type=int, default=5000)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--productos", type=int, default=3, help="Cantidad de productos calientes")
+    parser.add_argument("--stock", type=int, default=1000, help="Stock inicial de cada producto")
+    parser.add_argument("--limpiar", action="store_true", help="Borrar los datos de prueba al terminar")
+    parser.add_argument("--esperar", type=float, default=0,
+                        help="Segundos a esperar antes de verificar (modo redis: que el reconciliador aplique el stock)")
+    parser.add_argument("--etiqueta", default="actual")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTES", "DESPUES"))
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    conn = psycopg2.connect(args.dsn)
+    ids = crear_productos(conn, args.productos, args.stock)
+    rng = random.Random(42)
+    estados = {}
+
+    async def peticion(cliente, i):
+        # Cada pedido lleva 1..n productos calientes en orden aleatorio para forzar contención cruzada
+        seleccion = rng.sample(ids, rng.randint(1, len(ids)))
+        carrito = {
+            "cliente_nombre": f"bench-{i}",
+            "cliente_email": f"bench-{i}@example.com",
+            "items": [{"producto_id": pid, "cantidad": rng.randint(1, 2)} for pid in seleccion],
+        }
+        respuesta = await cliente.post(f"{args.url}/cart/pedidos", json=carrito)
+        estados[respuesta.status_code] = estados.get(respuesta.status_code, 0) + 1
+        return respuesta
+
+    resultado = await ejecutar_carga(peticion, args.pedidos, args.concurrencia)
+    if args.esperar:
+        time.sleep(args.esperar)
+    sobreventa, productos = verificar(conn, ids, args.stock)
+
+    resultado.update({
+        "etiqueta": args.etiqueta,
+        "pedidos_confirmados": estados.get(201, 0),
+        "pedidos_rechazados": estados.get(400, 0),
+        "codigos": {str(k): v for k, v in sorted(estados.items())},
+        "sobreventa": sobreventa,
+        "productos": productos,
+    })
+    print(json.dumps(resultado, indent=2))
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultado, f, indent=2)
+
+    if args.limpiar:
+        limpiar(conn, ids)
+    conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
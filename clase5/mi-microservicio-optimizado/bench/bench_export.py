@@ -0,0 +1,116 @@
+"""Verifica que la exportación en streaming mantenga la memoria del servicio acotada
+
+Genera (opcionalmente) un catálogo grande, descarga /api/productos/export o /cart/pedidos/export
+y muestrea la memoria del contenedor con `docker stats` mientras dura la descarga. Termina con
+código 1 si la memoria máxima supera --techo-mb.
+
+Uso:
+    python bench/bench_export.py --generar 200000 --techo-mb 150
+    python bench/bench_export.py --url http://localhost:8003/cart/pedidos/export --contenedor backend_s2
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import psycopg2
+
+UNIDADES = {"B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "kB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3}
+
+
+def memoria_contenedor(contenedor):
+    """Memoria en uso del contenedor en MB según `docker stats`"""
+    salida = subprocess.run(
+        ["docker", "stats", "--no-stream", "--format", "{{.MemUsage}}", contenedor],
+        capture_output=True, text=True, check=True
+    ).stdout
+    uso = salida.split("/")[0].strip()
+    for unidad in sorted(UNIDADES, key=len, reverse=True):
+        if uso.endswith(unidad):
+            return float(uso[:-len(unidad)]) * UNIDADES[unidad] / 1024 ** 2
+    return 0.0
+
+
+def generar_productos(dsn, cantidad):
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO productos (nombre, categoria, precio, stock, marca, descripcion)
+                SELECT 'export-bench-' || i, 'Benchmark', (random() * 1000)::numeric(10, 2), 100, 'Benchmark',
+                       repeat('descripcion de prueba ', 10)
+                FROM generate_series(1, %s) AS i
+                """,
+                (cantidad,)
+            )
+    print(f"✓ {cantidad} productos generados")
+
+
+def limpiar_productos(dsn):
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM productos WHERE nombre LIKE 'export-bench-%%'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8002/api/productos/export")
+    parser.add_argument("--formato", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--contenedor", default="backend_s1")
+    parser.add_argument("--dsn", default="host=localhost port=5432 dbname=tienda_hardware user=postgres password=postgres123")
+    parser.add_argument("--generar", type=int, default=0, help="Productos de prueba a insertar antes de exportar")
+    parser.add_argument("--limpiar", action="store_true", help="Borrar los productos de prueba al terminar")
+    parser.add_argument("--techo-mb", type=float, default=150.0, help="Memoria máxima permitida del contenedor")
+    args = parser.parse_args()
+
+    if args.generar:
+        generar_productos(args.dsn, args.generar)
+
+    muestras = [memoria_contenedor(args.contenedor)]
+    terminado = threading.Event()
+
+    def muestrear():
+        while not terminado.is_set():
+            muestras.append(memoria_contenedor(args.contenedor))
+
+    hilo = threading.Thread(target=muestrear, daemon=True)
+    hilo.start()
+
+    filas = 0
+    bytes_totales = 0
+    inicio = time.perf_counter()
+    with httpx.stream("GET", args.url, params={"formato": args.formato}, timeout=None) as respuesta:
+        respuesta.raise_for_status()
+        for linea in respuesta.iter_lines():
+            filas += 1
+            bytes_totales += len(linea) + 1
+    duracion = time.perf_counter() - inicio
+    terminado.set()
+    hilo.join()
+
+    if args.formato == "csv":
+        filas -= 1  # encabezado
+
+    resultado = {
+        "filas": filas,
+        "mb_transferidos": round(bytes_totales / 1024 ** 2, 2),
+        "duracion_s": round(duracion, 2),
+        "filas_por_s": round(filas / duracion, 1) if duracion else 0.0,
+        "memoria_inicial_mb": round(muestras[0], 1),
+        "memoria_max_mb": round(max(muestras), 1),
+        "techo_mb": args.techo_mb,
+    }
+    resultado["dentro_del_techo"] = resultado["memoria_max_mb"] <= args.techo_mb
+    print(json.dumps(resultado, indent=2))
+
+    if args.limpiar:
+        limpiar_productos(args.dsn)
+
+    sys.exit(0 if resultado["dentro_del_techo"] else 1)
+
+
+if __name__ == "__main__":
+    main()
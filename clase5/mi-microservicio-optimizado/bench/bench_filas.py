@@ -0,0 +1,103 @@
+"""Microbenchmark del camino fila -> JSON para listas de 10k y 100k filas
+
+Compara el cursor de dicts con json.dumps contra cursores de tuplas con conversión directa de
+DECIMAL y orjson. Las filas se generan con generate_series, no hace falta cargar datos:
+
+    python bench/bench_filas.py --dsn "host=localhost port=5432 dbname=tienda_hardware user=postgres password=postgres123"
+"""
+import argparse
+import json
+import time
+
+import orjson
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+from carga import percentil
+
+# Misma forma que SELECT id, nombre, categoria, precio, stock, marca FROM productos
+SQL = """
+    SELECT i AS id, 'Producto ' || i AS nombre, 'Categoria ' || (i % 12) AS categoria,
+           ((i % 5000) + 0.99)::DECIMAL(10, 2) AS precio, i % 50 AS stock, 'Marca ' || (i % 30) AS marca
+    FROM generate_series(1, %s) AS i
+"""
+
+# Igual que service1/main.py
+DECIMAL_A_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "DECIMAL_A_FLOAT",
+    lambda valor, cur: float(valor) if valor is not None else None
+)
+
+
+def dicts_json(conn, filas):
+    """Antes: un RealDictRow por fila, Decimal y json.dumps(default=str)"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(SQL, (filas,))
+        return json.dumps(cur.fetchall(), default=str).encode()
+
+
+def dicts_orjson(conn, filas):
+    """RealDictRow por fila con orjson (Decimal convertido en default)"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(SQL, (filas,))
+        return orjson.dumps(cur.fetchall(), default=float)
+
+
+def tuplas_objetos(conn, filas):
+    """Tuplas con DECIMAL -> float al decodificar y un dict plano por fila solo para serializar"""
+    with conn.cursor() as cur:
+        psycopg2.extensions.register_type(DECIMAL_A_FLOAT, cur)
+        cur.execute(SQL, (filas,))
+        columnas = [col.name for col in cur.description]
+        return orjson.dumps([dict(zip(columnas, fila)) for fila in cur.fetchall()])
+
+
+def tuplas_filas(conn, filas):
+    """Tuplas serializadas tal cual con una sola cabecera de columnas (formato=filas)"""
+    with conn.cursor() as cur:
+        psycopg2.extensions.register_type(DECIMAL_A_FLOAT, cur)
+        cur.execute(SQL, (filas,))
+        return orjson.dumps({"columnas": [col.name for col in cur.description], "filas": cur.fetchall()})
+
+
+CAMINOS = [dicts_json, dicts_orjson, tuplas_objetos, tuplas_filas]
+
+
+def medir(funcion, conn, filas, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        cuerpo = funcion(conn, filas)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        "p50_ms": round(percentil(tiempos, 50), 2),
+        "p95_ms": round(percentil(tiempos, 95), 2),
+        "bytes": len(cuerpo),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default="host=localhost port=5432 dbname=tienda_hardware user=postgres password=postgres123")
+    parser.add_argument("--filas", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    resultados = {}
+    for filas in args.filas:
+        resultados[filas] = {}
+        for funcion in CAMINOS:
+            funcion(conn, filas)  # calentamiento
+            resultados[filas][funcion.__name__] = res = medir(funcion, conn, filas, args.repeticiones)
+            print(f"{filas:>7} filas  {funcion.__name__:15} p50={res['p50_ms']}ms  p95={res['p95_ms']}ms  {res['bytes']} bytes")
+    conn.close()
+
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Latencia del catálogo directo al backend contra el proxy nginx (upstream con keepalive) y su micro-cache
+
+Modos medidos sobre las mismas rutas:
+    directo           cliente -> backend_s1
+    proxy             cliente -> nginx -> réplicas de backend_s1 (un parámetro distinto por petición evita la micro-cache)
+    proxy_microcache  cliente -> nginx, respondiendo desde la micro-cache la mayoría de las veces
+
+Con el perfil bench (dos réplicas más de cada backend detrás del proxy):
+    docker compose --profile bench up -d
+    docker compose --profile bench run --rm bench
+
+Desde el host:
+    python bench/bench_proxy.py --directo http://localhost:8002 --proxy http://localhost
+"""
+import argparse
+import asyncio
+import json
+
+from carga import ejecutar_carga, esperar_servicios
+
+RUTAS = ["/api/productos", "/api/categorias", "/api/productos/1"]
+
+
+async def medir(base_url, total, concurrencia, romper_cache):
+    estados_cache = {}
+
+    async def peticion(cliente, i):
+        # Los parámetros desconocidos no cambian la clave del cache de service1, solo la de nginx
+        params = {"sin_cache": i} if romper_cache else None
+        respuesta = await cliente.get(base_url + RUTAS[i % len(RUTAS)], params=params)
+        estado = respuesta.headers.get("x-cache-status", "-")
+        estados_cache[estado] = estados_cache.get(estado, 0) + 1
+        return respuesta
+
+    # Calentar el cache de service1 y los pools antes de medir
+    await ejecutar_carga(peticion, len(RUTAS) * 10, len(RUTAS))
+    estados_cache.clear()
+    resultado = await ejecutar_carga(peticion, total, concurrencia)
+    resultado["cache_proxy"] = dict(sorted(estados_cache.items()))
+    return resultado
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directo", default="http://localhost:8002", help="URL de backend_s1 sin proxy")
+    parser.add_argument("--proxy", default="http://localhost", help="URL del proxy nginx")
+    parser.add_argument("--total", type=int, default=5000)
+    parser.add_argument("--concurrencia", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--espera-servicios", type=float, default=120)
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    esperar_servicios([f"{args.directo}/api/health", f"{args.proxy}/api/health"], args.espera_servicios)
+
+    modos = (
+        ("directo", args.directo, False),
+        ("proxy", args.proxy, True),
+        ("proxy_microcache", args.proxy, False),
+    )
+    resultados = []
+    for concurrencia in args.concurrencia:
+        for modo, url, romper_cache in modos:
+            res = await medir(url, args.total, concurrencia, romper_cache)
+            res.update({"modo": modo, "concurrencia": concurrencia})
+            resultados.append(res)
+            print(f"{modo:16} c={concurrencia:<4} {res['rps']:>8} req/s  p50={res['p50_ms']}ms  "
+                  f"p95={res['p95_ms']}ms  p99={res['p99_ms']}ms  errores={res['errores']}  cache={res['cache_proxy']}")
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultados, f, indent=2)
+    else:
+        print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Utilidades compartidas por los benchmarks de carga"""
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def esperar_servicios(urls, espera):
+    """Espera a que cada URL (health check) responda 200, como máximo `espera` segundos en total"""
+    limite = time.monotonic() + espera
+    for url in urls:
+        while True:
+            try:
+                if httpx.get(url, timeout=2).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > limite:
+                raise SystemExit(f"✗ {url} no respondió en {espera}s")
+            time.sleep(1)
+    print("✓ Servicios listos")
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) de una lista de valores ya ordenada"""
+    if not valores:
+        return 0.0
+    indice = min(len(valores) - 1, max(0, round(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+def resumen(latencias, errores, duracion):
+    """Resume latencias (segundos) en un dict con throughput y percentiles en ms"""
+    latencias = sorted(latencias)
+    total = len(latencias) + errores
+    return {
+        "peticiones": total,
+        "errores": errores,
+        "duracion_s": round(duracion, 3),
+        "rps": round(total / duracion, 1) if duracion else 0.0,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+        "media_ms": round(statistics.fmean(latencias) * 1000, 2) if latencias else 0.0,
+    }
+
+
+async def ejecutar_carga(peticion, total, concurrencia):
+    """Ejecuta `total` llamadas a la corrutina `peticion(cliente, i)` con `concurrencia` clientes en paralelo"""
+    latencias = []
+    errores = 0
+    siguiente = iter(range(total))
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+
+    async with httpx.AsyncClient(limits=limites, timeout=30) as cliente:
+        async def trabajador():
+            nonlocal errores
+            for i in siguiente:
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await peticion(cliente, i)
+                    if respuesta.status_code >= 500:
+                        errores += 1
+                        continue
+                except httpx.HTTPError:
+                    errores += 1
+                    continue
+                latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+        duracion = time.perf_counter() - inicio
+
+    return resumen(latencias, errores, duracion)
@@ -0,0 +1,229 @@
+"""Suite de benchmarks reproducible para el catálogo (service1) y el checkout (service2)
+
+Ejecuta los escenarios en orden y guarda p50/p95/p99, req/s y errores de cada uno en un JSON con el
+commit medido, para comparar entre commits:
+
+    # Postgres, Redis y los dos servicios en contenedores locales
+    python bench/suite.py --levantar --salida base.json
+    git checkout otra-rama && docker compose build backend_s1 backend_s2
+    python bench/suite.py --levantar --salida nuevo.json
+    python bench/suite.py --comparar base.json nuevo.json --umbral 10
+
+Escenarios:
+    catalogo_frio     listados con claves de cache distintas después de vaciar el cache (misses)
+    catalogo_caliente el listado completo con el cache lleno (hits L1/Redis)
+    detalle           GET /api/productos/{id} sobre ids reales al azar
+    churn_categorias  lecturas por categoría mezcladas con altas de productos que invalidan las listas
+    checkout          pedidos concurrentes sobre pocos productos con stock conocido (verifica sobreventa)
+
+--comparar termina con código 1 si algún escenario empeora más que --umbral por ciento en p95, p99
+o req/s, para usarlo como chequeo de regresión.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+import psycopg2
+
+from bench_checkout import crear_productos, limpiar, verificar
+from carga import ejecutar_carga, esperar_servicios
+
+ESCENARIOS = ["catalogo_frio", "catalogo_caliente", "detalle", "churn_categorias", "checkout"]
+SERVICIOS_COMPOSE = ["db", "redis", "backend_s1", "backend_s2"]
+# Combinaciones de proyección: con los 500 valores de `limite` dan 1000 claves de cache distintas
+PROYECCIONES = ["id,nombre,precio", "id,nombre,categoria,precio,stock"]
+
+
+def commit_actual() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def levantar(urls, espera):
+    """Levanta Postgres, Redis y los servicios con docker compose y espera sus health checks"""
+    subprocess.run(["docker", "compose", "up", "-d", *SERVICIOS_COMPOSE], check=True)
+    esperar_servicios(urls, espera)
+
+
+async def catalogo_frio(args, ctx):
+    async with httpx.AsyncClient() as cliente:
+        (await cliente.post(f"{args.productos}/api/redis/clear")).raise_for_status()
+
+    async def peticion(cliente, i):
+        # Cada petición es una clave nueva: mide el camino completo de miss (pool, consulta, serialización)
+        proyeccion = PROYECCIONES[(i // 500) % len(PROYECCIONES)]
+        return await cliente.get(
+            f"{args.productos}/api/productos", params={"limite": i % 500 + 1, "fields": proyeccion}
+        )
+
+    return await ejecutar_carga(peticion, min(args.total, 500 * len(PROYECCIONES)), args.concurrencia)
+
+
+async def catalogo_caliente(args, ctx):
+    async def peticion(cliente, i):
+        return await cliente.get(f"{args.productos}/api/productos")
+
+    await ejecutar_carga(peticion, 50, 5)
+    return await ejecutar_carga(peticion, args.total, args.concurrencia)
+
+
+async def detalle(args, ctx):
+    async with httpx.AsyncClient() as cliente:
+        respuesta = await cliente.get(f"{args.productos}/api/productos", params={"fields": "id"})
+        respuesta.raise_for_status()
+    ids = [fila["id"] for fila in respuesta.json()]
+    rng = random.Random(args.semilla)
+
+    async def peticion(cliente, i):
+        return await cliente.get(f"{args.productos}/api/productos/{rng.choice(ids)}")
+
+    return await ejecutar_carga(peticion, args.total, args.concurrencia)
+
+
+async def churn_categorias(args, ctx):
+    async with httpx.AsyncClient() as cliente:
+        respuesta = await cliente.get(f"{args.productos}/api/categorias")
+        respuesta.raise_for_status()
+    categorias = respuesta.json()["categorias"] or ["Benchmark"]
+    rng = random.Random(args.semilla)
+    cada = max(1, round(100 / args.escrituras)) if args.escrituras else 0
+
+    async def peticion(cliente, i):
+        categoria = rng.choice(categorias)
+        if cada and i % cada == 0:
+            # El alta invalida las listas cacheadas: las lecturas siguientes vuelven a la base
+            return await cliente.post(f"{args.productos}/api/productos", json={
+                "nombre": f"bench-churn-{ctx['etiqueta']}-{i}",
+                "categoria": categoria,
+                "precio": 10.0,
+                "stock": 1,
+                "marca": "Benchmark",
+            })
+        return await cliente.get(f"{args.productos}/api/productos", params={"categoria": categoria})
+
+    return await ejecutar_carga(peticion, args.total, args.concurrencia)
+
+
+async def checkout(args, ctx):
+    ids = crear_productos(ctx["conn"], args.productos_checkout, args.total * 2)
+    ctx["productos_checkout"] = ids
+    rng = random.Random(args.semilla)
+
+    async def peticion(cliente, i):
+        seleccion = rng.sample(ids, rng.randint(1, len(ids)))
+        return await cliente.post(f"{args.pedidos}/cart/pedidos", json={
+            "cliente_nombre": f"bench-{i}",
+            "cliente_email": f"bench-{i}@example.com",
+            "items": [{"producto_id": pid, "cantidad": rng.randint(1, 2)} for pid in seleccion],
+        })
+
+    resultado = await ejecutar_carga(peticion, args.total, args.concurrencia)
+    if args.esperar:
+        time.sleep(args.esperar)
+    resultado["sobreventa"], _ = verificar(ctx["conn"], ids, args.total * 2)
+    return resultado
+
+
+def limpiar_datos(ctx):
+    with ctx["conn"].cursor() as cur:
+        cur.execute("DELETE FROM productos WHERE nombre LIKE %s", (f"bench-churn-{ctx['etiqueta']}-%",))
+    ctx["conn"].commit()
+    if ctx.get("productos_checkout"):
+        limpiar(ctx["conn"], ctx["productos_checkout"])
+
+
+def comparar(archivo_base, archivo_nuevo, umbral) -> bool:
+    """Imprime la diferencia por escenario; devuelve True si hay alguna regresión mayor al umbral"""
+    with open(archivo_base) as f:
+        base = json.load(f)
+    with open(archivo_nuevo) as f:
+        nuevo = json.load(f)
+    print(f"{base['commit']} -> {nuevo['commit']}  (umbral {umbral}%)")
+    print(f"{'escenario':18} {'métrica':8} {'base':>10} {'nuevo':>10} {'cambio':>9}")
+    regresion = False
+    for escenario, res in nuevo["escenarios"].items():
+        anterior = base["escenarios"].get(escenario)
+        if not anterior:
+            continue
+        for metrica in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            cambio = (res[metrica] / anterior[metrica] - 1) * 100 if anterior[metrica] else 0.0
+            # Más req/s es mejor; en las latencias, menos
+            peor = -cambio if metrica == "rps" else cambio
+            marca = ""
+            if metrica != "p50_ms" and peor > umbral:
+                regresion = True
+                marca = "  ✗ regresión"
+            print(f"{escenario:18} {metrica:8} {anterior[metrica]:>10} {res[metrica]:>10} {cambio:>+8.1f}%{marca}")
+    return regresion
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--productos", default="http://localhost:8002", help="URL del servicio de productos")
+    parser.add_argument("--pedidos", default="http://localhost:8003", help="URL del servicio de pedidos")
+    parser.add_argument("--dsn", default="host=localhost port=5432 dbname=tienda_hardware user=postgres password=postgres123")
+    parser.add_argument("--escenarios", nargs="+", choices=ESCENARIOS, default=ESCENARIOS)
+    parser.add_argument("--total", type=int, default=5000, help="Peticiones por escenario")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--escrituras", type=float, default=5, help="Porcentaje de altas en churn_categorias")
+    parser.add_argument("--productos-checkout", type=int, default=3, help="Productos calientes del checkout")
+    parser.add_argument("--esperar", type=float, default=0, help="Segundos antes de verificar el stock del checkout")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--levantar", action="store_true", help="Levantar db, redis y servicios con docker compose")
+    parser.add_argument("--espera-servicios", type=float, default=120)
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NUEVO"))
+    parser.add_argument("--umbral", type=float, default=10, help="Porcentaje de empeoramiento tolerado al comparar")
+    args = parser.parse_args()
+
+    if args.comparar:
+        sys.exit(1 if comparar(*args.comparar, args.umbral) else 0)
+
+    if args.levantar:
+        levantar([f"{args.productos}/api/health", f"{args.pedidos}/cart/health"], args.espera_servicios)
+
+    ctx = {"conn": psycopg2.connect(args.dsn), "etiqueta": uuid.uuid4().hex[:8]}
+    funciones = {nombre: globals()[nombre] for nombre in ESCENARIOS}
+    resultados = {}
+    try:
+        for nombre in args.escenarios:
+            resultados[nombre] = res = await funciones[nombre](args, ctx)
+            print(f"{nombre:18} {res['rps']:>8} req/s  p50={res['p50_ms']}ms  p95={res['p95_ms']}ms  "
+                  f"p99={res['p99_ms']}ms  errores={res['errores']}")
+    finally:
+        limpiar_datos(ctx)
+        ctx["conn"].close()
+
+    resultado = {
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parametros": {
+            "total": args.total,
+            "concurrencia": args.concurrencia,
+            "escrituras": args.escrituras,
+            "semilla": args.semilla,
+        },
+        "escenarios": resultados,
+    }
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultado, f, indent=2)
+    else:
+        print(json.dumps(resultado, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -36,6 +36,27 @@ CREATE TABLE IF NOT EXISTS pedido_items (
     subtotal DECIMAL(10, 2) NOT NULL
 );
 
+-- Motivo de rechazo de los pedidos procesados por la cola de checkout
+ALTER TABLE pedidos ADD COLUMN IF NOT EXISTS motivo TEXT;
+
+-- Items del pedido con nombre y precio al momento de la compra (GET /cart/pedidos/{id} sin JOIN)
+ALTER TABLE pedidos ADD COLUMN IF NOT EXISTS items_resumen JSONB;
+
+-- Claves de idempotencia de POST /cart/pedidos: hash de la petición y respuesta final
+CREATE TABLE IF NOT EXISTS pedidos_idempotencia (
+    clave VARCHAR(255) PRIMARY KEY,
+    hash CHAR(64) NOT NULL,
+    pedido_id INTEGER REFERENCES pedidos(id) ON DELETE CASCADE,
+    respuesta JSONB,
+    expira_en TIMESTAMP NOT NULL
+);
+
+-- Lotes de stock reservado en Redis ya aplicados a productos (CHECKOUT_MODO_BLOQUEO=redis)
+CREATE TABLE IF NOT EXISTS stock_reconciliaciones (
+    lote VARCHAR(64) PRIMARY KEY,
+    aplicado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE INDEX idx_categoria ON productos(categoria);
 CREATE INDEX idx_marca ON productos(marca);
 CREATE INDEX idx_precio ON productos(precio);
@@ -44,6 +65,47 @@ CREATE INDEX IF NOT EXISTS idx_pedidos_fecha ON pedidos(fecha DESC);
 CREATE INDEX IF NOT EXISTS idx_pedidos_estado ON pedidos(estado);
 CREATE INDEX IF NOT EXISTS idx_pedido_items_pedido ON pedido_items(pedido_id);
 CREATE INDEX IF NOT EXISTS idx_pedido_items_producto ON pedido_items(producto_id);
+CREATE INDEX IF NOT EXISTS idx_pedidos_idempotencia_expira ON pedidos_idempotencia(expira_en);
+
+-- Índices para la paginación por keyset de /api/productos y /cart/pedidos
+CREATE INDEX IF NOT EXISTS idx_productos_nombre_id ON productos(nombre, id);
+CREATE INDEX IF NOT EXISTS idx_productos_categoria_nombre_id ON productos(categoria, nombre, id);
+CREATE INDEX IF NOT EXISTS idx_pedidos_fecha_id ON pedidos(fecha DESC, id DESC);
+
+-- Búsqueda de texto completo y por similitud para /api/productos/search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS busqueda tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(marca, '')), 'B') ||
+        setweight(to_tsvector('spanish', coalesce(descripcion, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_productos_busqueda ON productos USING GIN (busqueda);
+CREATE INDEX IF NOT EXISTS idx_productos_nombre_trgm ON productos USING GIN (nombre gin_trgm_ops);
+
+-- Marca de agua para el refresco incremental del catálogo en memoria: el id (64 bits) de la transacción
+-- que cambió por última vez una columna del catálogo. Sin índice a propósito: así el UPDATE de stock del
+-- checkout sigue siendo HOT y no escribe en los índices de productos (incluidos los GIN); el refresco
+-- recorre la tabla, que es chica, cada CATALOGO_REFRESCO segundos
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS txid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint;
+
+CREATE OR REPLACE FUNCTION marcar_txid_producto() RETURNS trigger AS $$
+BEGIN
+    NEW.txid = pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Los INSERT toman el txid del DEFAULT; un UPDATE solo lo renueva si cambia lo que muestra el catálogo
+DROP TRIGGER IF EXISTS trg_productos_txid ON productos;
+CREATE TRIGGER trg_productos_txid
+    BEFORE UPDATE OF nombre, categoria, precio, stock, marca ON productos
+    FOR EACH ROW
+    WHEN ((OLD.nombre, OLD.categoria, OLD.precio, OLD.stock, OLD.marca)
+          IS DISTINCT FROM (NEW.nombre, NEW.categoria, NEW.precio, NEW.stock, NEW.marca))
+    EXECUTE FUNCTION marcar_txid_producto();
 
 
 
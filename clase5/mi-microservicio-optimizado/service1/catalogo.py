@@ -0,0 +1,222 @@
+"""Snapshot columnar del catálogo en memoria para filtrar y ordenar sin ir a Postgres"""
+from typing import Optional
+import logging
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger("catalogo")
+
+ORDENES = ("nombre", "-nombre", "precio", "-precio", "stock", "-stock", "id", "-id")
+
+
+class Diccionario:
+    """Codificación por diccionario: cada texto distinto se guarda una vez y las filas guardan su código"""
+
+    def __init__(self):
+        self.valores = []
+        self.codigos = {}
+
+    def codificar(self, valor: str) -> int:
+        codigo = self.codigos.get(valor)
+        if codigo is None:
+            codigo = self.codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+        return codigo
+
+
+class Snapshot:
+    """Columnas inmutables de una versión del catálogo; una actualización crea un Snapshot nuevo"""
+
+    def __init__(self, ids, precios, stock, categorias, marcas, nombres, rango_nombre):
+        self.ids = ids                    # int64
+        self.precios = precios            # float64
+        self.stock = stock                # int32
+        self.categorias = categorias      # int32, códigos del diccionario de categorías
+        self.marcas = marcas              # int32, códigos del diccionario de marcas
+        self.nombres = nombres            # lista de str (solo para construir la respuesta)
+        self.rango_nombre = rango_nombre  # int32, posición de cada fila en el orden por nombre
+
+    @classmethod
+    def vacio(cls):
+        return cls(
+            np.empty(0, np.int64), np.empty(0, np.float64), np.empty(0, np.int32),
+            np.empty(0, np.int32), np.empty(0, np.int32), [], np.empty(0, np.int32)
+        )
+
+
+class CatalogoColumnar:
+    """Catálogo en arrays tipados que se actualiza de forma incremental por id de transacción (txid)"""
+
+    def __init__(self, get_db_connection, intervalo: float):
+        self.get_db_connection = get_db_connection
+        self.intervalo = intervalo
+        self.dic_categorias = Diccionario()
+        self.dic_marcas = Diccionario()
+        self._snapshot = Snapshot.vacio()
+        self._posiciones = {}
+        self._marca_agua = 0
+        self._lock = threading.Lock()
+        self._hilo = None
+        self.actualizaciones = 0
+        self.ultima_actualizacion = None
+
+    def refrescar(self) -> int:
+        """Trae las filas escritas desde la marca de agua y publica un snapshot nuevo
+
+        La marca es el xmin del snapshot de la lectura: toda transacción con un txid menor ya terminó y,
+        si confirmó, sus filas están en esa lectura. Las que siguen en curso tienen txid >= xmin y se
+        leen en el próximo refresco, por larga que sea la transacción (a costa de releer algunas filas).
+        """
+        with self._lock:
+            with self.get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    # Un solo snapshot para el corte y las filas
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+                    corte = cur.fetchone()[0]
+                    cur.execute(
+                        """
+                        SELECT id, nombre, categoria, precio, stock, marca
+                        FROM productos
+                        WHERE txid >= %s
+                        ORDER BY id
+                        """,
+                        (self._marca_agua,)
+                    )
+                    filas = cur.fetchall()
+                conn.rollback()
+
+            if filas:
+                self._aplicar(filas)
+            self._marca_agua = corte
+            self.actualizaciones += 1
+            self.ultima_actualizacion = time.time()
+            return len(filas)
+
+    def _aplicar(self, filas):
+        actual = self._snapshot
+        ids = actual.ids.copy()
+        precios = actual.precios.copy()
+        stock = actual.stock.copy()
+        categorias = actual.categorias.copy()
+        marcas = actual.marcas.copy()
+        nombres = list(actual.nombres)
+
+        nuevas = []
+        for producto_id, nombre, categoria, precio, cantidad, marca in filas:
+            posicion = self._posiciones.get(producto_id)
+            if posicion is None:
+                nuevas.append((producto_id, nombre, categoria, precio, cantidad, marca))
+                continue
+            precios[posicion] = float(precio)
+            stock[posicion] = cantidad
+            categorias[posicion] = self.dic_categorias.codificar(categoria)
+            marcas[posicion] = self.dic_marcas.codificar(marca)
+            nombres[posicion] = nombre
+
+        if nuevas:
+            inicio = len(ids)
+            ids = np.concatenate([ids, np.fromiter((f[0] for f in nuevas), np.int64, len(nuevas))])
+            precios = np.concatenate([precios, np.fromiter((float(f[3]) for f in nuevas), np.float64, len(nuevas))])
+            stock = np.concatenate([stock, np.fromiter((f[4] for f in nuevas), np.int32, len(nuevas))])
+            categorias = np.concatenate([categorias, np.fromiter(
+                (self.dic_categorias.codificar(f[2]) for f in nuevas), np.int32, len(nuevas))])
+            marcas = np.concatenate([marcas, np.fromiter(
+                (self.dic_marcas.codificar(f[5]) for f in nuevas), np.int32, len(nuevas))])
+            for desplazamiento, fila in enumerate(nuevas):
+                self._posiciones[fila[0]] = inicio + desplazamiento
+                nombres.append(fila[1])
+
+        # Rango por (nombre, id) en orden de code points de Python: no es la collation de Postgres, así que
+        # puede diferir del ORDER BY nombre de get_productos_from_db en mayúsculas, acentos y signos
+        orden = sorted(range(len(nombres)), key=lambda i: (nombres[i], ids[i]))
+        rango_nombre = np.empty(len(nombres), np.int32)
+        rango_nombre[orden] = np.arange(len(nombres), dtype=np.int32)
+
+        self._snapshot = Snapshot(ids, precios, stock, categorias, marcas, nombres, rango_nombre)
+
+    def iniciar(self):
+        """Carga inicial y refresco periódico en un hilo (se llama después del fork del worker)"""
+        if self._hilo is not None:
+            return
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="catalogo-refresco", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                self.refrescar()
+            except Exception as e:
+                log.error("Error al refrescar el catálogo en memoria: %s", e)
+            time.sleep(self.intervalo)
+
+    def consultar(self, categoria: Optional[str] = None, marca: Optional[str] = None,
+                  precio_min: Optional[float] = None, precio_max: Optional[float] = None,
+                  con_stock: bool = False, orden: str = "nombre", limite: int = 50, desplazamiento: int = 0):
+        """Filtra y ordena con operaciones vectorizadas sobre las columnas del snapshot"""
+        snap = self._snapshot
+        mascara = np.ones(len(snap.ids), dtype=bool)
+
+        if categoria is not None:
+            codigo = self.dic_categorias.codigos.get(categoria)
+            if codigo is None:
+                return {"total": 0, "productos": []}
+            mascara &= snap.categorias == codigo
+        if marca is not None:
+            codigo = self.dic_marcas.codigos.get(marca)
+            if codigo is None:
+                return {"total": 0, "productos": []}
+            mascara &= snap.marcas == codigo
+        if precio_min is not None:
+            mascara &= snap.precios >= precio_min
+        if precio_max is not None:
+            mascara &= snap.precios <= precio_max
+        if con_stock:
+            mascara &= snap.stock > 0
+
+        indices = np.flatnonzero(mascara)
+        columna = orden.lstrip("-")
+        claves = {
+            "nombre": snap.rango_nombre,
+            "precio": snap.precios,
+            "stock": snap.stock,
+            "id": snap.ids,
+        }[columna][indices]
+        # Orden estable con desempate por nombre
+        orden_indices = np.lexsort((snap.rango_nombre[indices], -claves if orden.startswith("-") else claves))
+        seleccion = indices[orden_indices][desplazamiento:desplazamiento + limite]
+
+        categorias = self.dic_categorias.valores
+        marcas = self.dic_marcas.valores
+        return {
+            "total": int(len(indices)),
+            "productos": [
+                {
+                    "id": int(snap.ids[i]),
+                    "nombre": snap.nombres[i],
+                    "categoria": categorias[snap.categorias[i]],
+                    "precio": float(snap.precios[i]),
+                    "stock": int(snap.stock[i]),
+                    "marca": marcas[snap.marcas[i]],
+                }
+                for i in seleccion
+            ],
+        }
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        memoria = sum(col.nbytes for col in (snap.ids, snap.precios, snap.stock, snap.categorias, snap.marcas, snap.rango_nombre))
+        return {
+            "filas": int(len(snap.ids)),
+            "categorias": len(self.dic_categorias.valores),
+            "marcas": len(self.dic_marcas.valores),
+            "bytes_columnas": int(memoria),
+            "marca_agua": self._marca_agua,
+            "actualizaciones": self.actualizaciones,
+            "ultima_actualizacion": self.ultima_actualizacion,
+        }
@@ -0,0 +1,78 @@
+"""Configuración de gunicorn para producción: workers uvicorn según la cuota de CPU del contenedor
+
+    gunicorn -c gunicorn.conf.py main:app
+
+La app se importa en cada worker después del fork y el pool de PostgreSQL y los clientes de Redis se
+crean en su lifespan, así que ningún socket se comparte entre procesos. Cada worker tiene su propio
+pool: las conexiones a Postgres son workers x DB_POOL_MAX.
+"""
+import glob
+import math
+import os
+
+
+def cpus_disponibles() -> float:
+    """CPUs que puede usar el contenedor: la cuota del cgroup (v2 o v1) o, sin límite, las asignadas"""
+    cpus = len(os.sched_getaffinity(0))
+    cuota = None
+    try:
+        # cgroup v2: "max 100000" o "50000 100000" (cuota y período en µs)
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limite, periodo = f.read().split()
+        if limite != "max":
+            cuota = int(limite) / int(periodo)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limite = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                periodo = int(f.read())
+            if limite > 0:
+                cuota = limite / periodo
+        except (OSError, ValueError):
+            pass
+    return min(cpus, cuota) if cuota else cpus
+
+
+# WEB_WORKERS fija la cantidad; si no, un worker por CPU de la cuota (limits.cpu: 500m -> 1, 2 -> 2)
+WEB_WORKERS_POR_CPU = float(os.getenv("WEB_WORKERS_POR_CPU", "1"))
+workers = int(os.getenv("WEB_WORKERS") or max(1, math.floor(cpus_disponibles() * WEB_WORKERS_POR_CPU)))
+worker_class = "uvicorn_worker.UvicornWorker"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Cada worker se recicla tras N peticiones para acotar el crecimiento de memoria; el jitter evita que
+# todos se reinicien a la vez
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "1000"))
+
+# SIGTERM (o reciclaje): el worker deja de aceptar conexiones, termina las peticiones en curso y cierra
+# sus conexiones. Debe ser menor que terminationGracePeriodSeconds de Kubernetes (30 s por defecto)
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "25"))
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+# Mayor que el keepalive_timeout del upstream en nginx (60 s): así es nginx quien cierra las conexiones
+# inactivas y nunca reutiliza una que el backend ya cerró
+keepalive = int(os.getenv("WEB_KEEPALIVE", "75"))
+
+# Sin preload: los hilos de logging, catálogo e invalidaciones se crean dentro de cada worker
+preload_app = False
+# El heartbeat de los workers en memoria y no en el overlay del contenedor
+worker_tmp_dir = "/dev/shm"
+# Sin access log: el del proxy ya registra cada petición con su request_id
+accesslog = None
+
+# Métricas Prometheus sumadas entre workers (ver metricas.respuesta_metricas); los workers heredan la variable
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus")
+
+
+def on_starting(server):
+    # Los archivos de una ejecución anterior del contenedor se sumarían a los contadores nuevos
+    directorio = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(directorio, exist_ok=True)
+    for archivo in glob.glob(os.path.join(directorio, "*.db")):
+        os.remove(archivo)
+
+
+def child_exit(server, worker):
+    # Los gauges "live" dejan de contar al worker que terminó
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
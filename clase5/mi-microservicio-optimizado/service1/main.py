@@ -1,14 +1,44 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Union
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from contextlib import contextmanager
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from contextlib import asynccontextmanager, contextmanager
 import redis
 import json
+import logging
+import orjson
+import base64
+import csv
+import hashlib
+import io
+import math
+import tempfile
+from decimal import Decimal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
-app = FastAPI(title="Tienda Hardware API - Productos")
+from metricas import MiddlewareMetricas, CursorMedido, medir, contar_evento_cache, registrar_pool, respuesta_metricas
+from registro import MiddlewareRequestId, configurar_logging, registrar_evento_cache
+
+configurar_logging("productos")
+log = logging.getLogger("productos")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Las conexiones de cada worker se crean al arrancar, no al importar, y se cierran al drenar"""
+    conectar_redis()
+    yield
+    cerrar_conexiones()
+
+app = FastAPI(title="Tienda Hardware API - Productos", lifespan=lifespan)
 
 # Configurar CORS
 app.add_middleware(
@@ -18,6 +48,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MiddlewareMetricas)
+app.add_middleware(MiddlewareRequestId)
 
 # Configuración de la base de datos
 import os
@@ -30,32 +62,665 @@ DB_CONFIG = {
     "port": int(os.getenv("DB_PORT"))
 }
 
-# Configuración de Redis con manejo de errores
-try:
-    redis_client = redis.Redis(
+# Clientes de Redis del proceso: los crea conectar_redis() al iniciar cada worker (después del fork)
+redis_client = None
+redis_raw = None
+
+CACHE_TTL = 300
+# Segundos adicionales en los que un valor vencido se sirve mientras se refresca en segundo plano (0 = desactivado)
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "60"))
+# Tiempo máximo del lock de recálculo y espera máxima de las réplicas que no lo obtienen
+CACHE_LOCK_TTL_MS = int(os.getenv("CACHE_LOCK_TTL_MS", "10000"))
+CACHE_LOCK_ESPERA = float(os.getenv("CACHE_LOCK_ESPERA", "2"))
+
+# Cache L1 en memoria de cada proceso, delante de Redis (0 entradas = desactivado)
+CACHE_L1_MAX_ENTRADAS = int(os.getenv("CACHE_L1_MAX_ENTRADAS", "1000"))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "30"))
+CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", "262144"))
+# Canal pub/sub por el que se anuncian las invalidaciones a todas las réplicas
+CANAL_INVALIDACIONES = "cache:invalidaciones"
+
+# Índices de claves por namespace: permiten invalidar sin recorrer el keyspace con KEYS
+CACHE_INDICE_DETALLE = "cache:idx:producto"
+CACHE_INDICE_CATEGORIAS = "cache:idx:categorias"
+CACHE_INDICES = (CACHE_INDICE_DETALLE, CACHE_INDICE_CATEGORIAS)
+# Las listas (páginas, proyecciones y búsquedas) no tienen índice: llevan en la clave la generación del
+# namespace, invalidarlas es un INCR y las claves de generaciones anteriores vencen solas por TTL
+CACHE_GENERACION_LISTAS = "cache:gen:productos"
+
+# Borra todas las claves registradas en un índice y el índice mismo en una sola operación atómica
+LUA_INVALIDAR_INDICE = """
+local claves = redis.call('SMEMBERS', KEYS[1])
+for i = 1, #claves, 500 do
+    redis.call('UNLINK', unpack(claves, i, math.min(i + 499, #claves)))
+end
+redis.call('DEL', KEYS[1])
+return #claves
+"""
+invalidar_indice = None
+
+def indice_cache(cache_key: str) -> Optional[str]:
+    """Índice (namespace) al que pertenece una clave de cache; None en las listas, que van por generación"""
+    if cache_key.startswith("producto:"):
+        return CACHE_INDICE_DETALLE
+    if cache_key.startswith("categorias:"):
+        return CACHE_INDICE_CATEGORIAS
+    return None
+
+def _json_default(valor):
+    # Los DECIMAL(10,2) se exponen como float, igual que en los modelos de respuesta
+    if isinstance(valor, Decimal):
+        return float(valor)
+    raise TypeError
+
+def serializar(datos) -> bytes:
+    """Serializa el cuerpo de respuesta con orjson (acepta dict, tuplas, Decimal y datetime)"""
+    with medir("serializacion"):
+        return orjson.dumps(datos, default=_json_default)
+
+def respuesta_json(cuerpo: bytes) -> Response:
+    """Devuelve bytes ya serializados sin volver a validarlos ni codificarlos"""
+    return Response(content=cuerpo, media_type="application/json")
+
+# Cache HTTP del catálogo (navegador y proxy): segundos de frescura antes de revalidar con If-None-Match
+CACHE_HTTP_MAX_AGE = int(os.getenv("CACHE_HTTP_MAX_AGE", "5"))
+CACHE_HTTP_MAX_AGE_CATEGORIAS = int(os.getenv("CACHE_HTTP_MAX_AGE_CATEGORIAS", "60"))
+
+def calcular_etag(cuerpo: bytes) -> str:
+    """ETag fuerte a partir del contenido exacto de la respuesta"""
+    return '"' + hashlib.blake2b(cuerpo, digest_size=16).hexdigest() + '"'
+
+def coincide_etag(if_none_match: str, etag: str) -> bool:
+    # If-None-Match compara en forma débil: W/"x" (p. ej. tras gzip en nginx) equivale a "x"
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidato.strip().removeprefix("W/") == etag for candidato in if_none_match.split(","))
+
+def respuesta_condicional(cache_key: str, cuerpo: bytes, if_none_match: Optional[str],
+                          max_age: int = CACHE_HTTP_MAX_AGE) -> Response:
+    """Cuerpo cacheado con ETag y Cache-Control; 304 sin cuerpo si el cliente ya tiene esa versión"""
+    etag = cache_local.etag(cache_key, cuerpo)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if if_none_match and coincide_etag(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+def guardar_en_cache(cache_key: str, valor: bytes):
+    """Guarda un valor en Redis y registra la clave en el índice de su namespace"""
+    indice = indice_cache(cache_key)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.setex(cache_key, CACHE_TTL + CACHE_STALE_TTL, valor)
+    if indice:
+        pipe.sadd(indice, cache_key)
+        pipe.expire(indice, CACHE_TTL + CACHE_STALE_TTL)
+    with medir("redis_set"):
+        pipe.execute()
+
+def guardar_varias_en_cache(valores: dict):
+    """Guarda varias claves en un solo pipeline (un SETEX por clave y un SADD por índice)"""
+    pipe = redis_client.pipeline(transaction=False)
+    indices = {}
+    for cache_key, valor in valores.items():
+        pipe.setex(cache_key, CACHE_TTL + CACHE_STALE_TTL, valor)
+        indice = indice_cache(cache_key)
+        if indice:
+            indices.setdefault(indice, []).append(cache_key)
+    for indice, claves in indices.items():
+        pipe.sadd(indice, *claves)
+        pipe.expire(indice, CACHE_TTL + CACHE_STALE_TTL)
+    with medir("redis_set"):
+        pipe.execute()
+
+class CacheLocal:
+    """Cache L1 en memoria del proceso: LRU acotado con TTL y límite de tamaño por entrada (en bytes)"""
+
+    def __init__(self, max_entradas: int, ttl: float, max_bytes: int):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self.desalojos = 0
+
+    def get(self, clave: str):
+        if not self.max_entradas:
+            return None
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            expira, valor, _ = entrada
+            if expira < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return valor
+
+    def set(self, clave: str, valor: bytes):
+        if not self.max_entradas or len(valor) > self.max_bytes:
+            return
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor, None)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.desalojos += 1
+
+    def etag(self, clave: str, valor: bytes) -> str:
+        """ETag del cuerpo; se calcula una vez por entrada del L1 y se reutiliza mientras el cuerpo sea el mismo"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[1] is valor and entrada[2] is not None:
+                return entrada[2]
+        etiqueta = calcular_etag(valor)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[1] is valor:
+                self._entradas[clave] = (entrada[0], valor, etiqueta)
+        return etiqueta
+
+    def delete(self, claves):
+        """Elimina claves exactas o, si terminan en '*', todas las que empiezan con ese prefijo"""
+        with self._lock:
+            for clave in claves:
+                if clave.endswith("*"):
+                    prefijo = clave[:-1]
+                    for existente in [c for c in self._entradas if c.startswith(prefijo)]:
+                        del self._entradas[existente]
+                else:
+                    self._entradas.pop(clave, None)
+
+    def clear(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "ttl": self.ttl,
+                "desalojos": self.desalojos,
+            }
+
+cache_local = CacheLocal(CACHE_L1_MAX_ENTRADAS, CACHE_L1_TTL, CACHE_L1_MAX_BYTES)
+
+class GeneracionListas:
+    """Generación vigente de las listas en este proceso
+
+    Con la suscripción activa se actualiza con cada invalidación anunciada (el mismo camino que mantiene
+    coherente el L1); sin ella, o mientras se reconecta, se lee de Redis en cada consulta.
+    """
+
+    def __init__(self):
+        self._valor = None
+        self._lock = threading.Lock()
+
+    def actual(self) -> int:
+        valor = self.local()
+        return valor if valor is not None else self.leer()
+
+    def local(self) -> Optional[int]:
+        """Generación mantenida por la suscripción, o None si hay que leerla de Redis"""
+        asegurar_suscripcion()
+        return self._valor
+
+    def leer(self) -> int:
+        if not redis_client:
+            return 0
+        try:
+            return int(redis_client.get(CACHE_GENERACION_LISTAS) or 0)
+        except redis.RedisError as e:
+            log.error("Error al leer la generación de las listas: %s", e)
+            return 0
+
+    def fijar(self, valor: Optional[int]):
+        with self._lock:
+            self._valor = valor
+
+    def actualizar(self, valor: int):
+        # Los avisos de invalidaciones concurrentes pueden llegar desordenados: solo se avanza
+        with self._lock:
+            if self._valor is not None and valor > self._valor:
+                self._valor = valor
+
+    def invalidar(self) -> int:
+        """Pasa a una generación nueva; las claves de la anterior dejan de leerse"""
+        valor = redis_client.incr(CACHE_GENERACION_LISTAS)
+        self.actualizar(valor)
+        return valor
+
+generacion_listas = GeneracionListas()
+
+def clave_listas(sufijo: str, generacion: Optional[int] = None) -> str:
+    """Clave de cache del namespace de listas con la generación vigente (o la ya leída por el llamador)"""
+    if generacion is None:
+        generacion = generacion_listas.actual()
+    return f"productos:g{generacion}:{sufijo}"
+
+def procesar_invalidacion(mensaje: str):
+    """Aplica en el L1 una invalidación recibida por pub/sub
+
+    El mensaje es "*" (todo), una lista JSON de claves/prefijos, o {"claves": [...] | null, "generacion": n}
+    cuando además cambió la generación de las listas.
+    """
+    if mensaje == "*":
+        cache_local.clear()
+        return
+    datos = json.loads(mensaje)
+    if isinstance(datos, dict):
+        generacion_listas.actualizar(datos["generacion"])
+        datos = datos["claves"]
+    if datos is None:
+        cache_local.clear()
+    else:
+        cache_local.delete(datos)
+
+def escuchar_invalidaciones():
+    """Hilo suscrito al canal de invalidaciones, se reconecta si Redis se reinicia"""
+    # Cliente dedicado sin socket_timeout: listen() bloquea hasta que llega un mensaje
+    cliente = redis.Redis(
         host=os.getenv("REDIS_HOST"),
         port=int(os.getenv("REDIS_PORT")),
         db=0,
         decode_responses=True,
         socket_connect_timeout=5,
-        socket_timeout=5
+        health_check_interval=30
     )
-    # Verificar conexión
-    redis_client.ping()
-    print("✓ Conectado a Redis exitosamente")
-except redis.RedisError as e:
-    print(f"✗ No se pudo conectar a Redis: {e}")
-    redis_client = None
+    while True:
+        try:
+            pubsub = cliente.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CANAL_INVALIDACIONES)
+            # Mientras no hubo suscripción se pudieron perder mensajes
+            cache_local.clear()
+            generacion_listas.fijar(generacion_listas.leer())
+            for mensaje in pubsub.listen():
+                procesar_invalidacion(mensaje["data"])
+        except (redis.RedisError, ValueError) as e:
+            log.error("Error en la suscripción de invalidaciones: %s", e)
+            cache_local.clear()
+            # Sin avisos la generación local puede quedar vieja: se vuelve a leer de Redis en cada consulta
+            generacion_listas.fijar(None)
+            time.sleep(1)
 
-CACHE_TTL = 300
+_suscripcion_iniciada = False
+_suscripcion_lock = threading.Lock()
+
+def asegurar_suscripcion():
+    """Inicia el hilo de invalidaciones la primera vez que se usa el L1 (después del fork)"""
+    global _suscripcion_iniciada
+    if _suscripcion_iniciada or not redis_client or not CACHE_L1_MAX_ENTRADAS:
+        return
+    with _suscripcion_lock:
+        if not _suscripcion_iniciada:
+            threading.Thread(target=escuchar_invalidaciones, name="cache-invalidaciones", daemon=True).start()
+            _suscripcion_iniciada = True
+
+class EstadisticasCache:
+    """Contadores de aciertos, fallos, valores vencidos y peticiones agrupadas"""
+
+    EVENTOS = ("l1_hit", "hit", "miss", "stale", "coalesced", "refresh")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = dict.fromkeys(self.EVENTOS, 0)
+
+    def contar(self, evento: str, cache_key: str):
+        with self._lock:
+            self._contadores[evento] += 1
+        contar_evento_cache(cache_key, evento)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            datos = dict(self._contadores)
+        consultas = datos["l1_hit"] + datos["hit"] + datos["stale"] + datos["miss"]
+        aciertos = datos["l1_hit"] + datos["hit"] + datos["stale"]
+        datos["hit_ratio"] = round(aciertos / consultas, 4) if consultas else 0.0
+        return datos
+
+estadisticas_cache = EstadisticasCache()
+
+# Libera el lock solo si sigue perteneciendo a quien lo tomó
+LUA_LIBERAR_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+liberar_lock = None
+
+def conectar_redis():
+    """Crea los clientes de Redis y registra los scripts Lua (una vez por worker, en el arranque)"""
+    global redis_client, redis_raw, invalidar_indice, liberar_lock
+    try:
+        redis_client = redis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            db=0,
+            decode_responses=True,
+            socket_connect_timeout=5,
+            socket_timeout=5
+        )
+        # Cliente sin decodificación para leer del cache los cuerpos de respuesta tal cual (bytes)
+        redis_raw = redis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            db=0,
+            socket_connect_timeout=5,
+            socket_timeout=5
+        )
+        # Verificar conexión
+        redis_client.ping()
+        log.info("Conectado a Redis")
+    except redis.RedisError as e:
+        log.warning("No se pudo conectar a Redis: %s", e)
+        redis_client = None
+        redis_raw = None
+    invalidar_indice = redis_client.register_script(LUA_INVALIDAR_INDICE) if redis_client else None
+    liberar_lock = redis_client.register_script(LUA_LIBERAR_LOCK) if redis_client else None
+
+# Vuelos en curso por clave: las peticiones concurrentes del mismo proceso esperan al primero
+_vuelos = {}
+_vuelos_lock = threading.Lock()
+_refrescos = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+def leer_cache(cache_key: str):
+    """Devuelve (bytes, ttl restante) de una clave, o (None, None) si no existe o Redis falla"""
+    if not redis_raw:
+        return None, None
+    try:
+        pipe = redis_raw.pipeline(transaction=False)
+        pipe.get(cache_key)
+        pipe.ttl(cache_key)
+        with medir("redis_get"):
+            valor, ttl = pipe.execute()
+        return valor, ttl
+    except redis.RedisError as e:
+        log.error("Error al leer de Redis: %s", e)
+        return None, None
+
+def leer_cache_varias(claves: List[str]) -> list:
+    """Lee varias claves con un MGET; None en las que no existen (o en todas si Redis falla)"""
+    if not redis_raw:
+        return [None] * len(claves)
+    try:
+        with medir("redis_get"):
+            return redis_raw.mget(claves)
+    except redis.RedisError as e:
+        log.error("Error al leer de Redis: %s", e)
+        return [None] * len(claves)
+
+def tomar_lock(cache_key: str, token: str) -> bool:
+    """Intenta tomar el lock de recálculo de una clave (entre réplicas)"""
+    if not redis_client:
+        return True
+    try:
+        return bool(redis_client.set(f"lock:{cache_key}", token, nx=True, px=CACHE_LOCK_TTL_MS))
+    except redis.RedisError:
+        return True
+
+def soltar_lock(cache_key: str, token: str):
+    if not redis_client:
+        return
+    try:
+        liberar_lock(keys=[f"lock:{cache_key}"], args=[token])
+    except redis.RedisError as e:
+        log.error("Error al liberar lock de cache: %s", e)
+
+def recalcular(cache_key: str, cargar) -> bytes:
+    """Consulta la fuente de datos y guarda en cache el cuerpo de respuesta serializado"""
+    valor = serializar(cargar())
+    if redis_client:
+        try:
+            guardar_en_cache(cache_key, valor)
+            log.debug("Datos guardados en cache", extra={"campos": {"clave": cache_key}})
+        except redis.RedisError as e:
+            log.error("Error al guardar en Redis: %s", e)
+    cache_local.set(cache_key, valor)
+    return valor
+
+def recalcular_con_lock(cache_key: str, cargar):
+    """Recalcula una clave: solo una réplica consulta la base, las demás esperan el resultado"""
+    token = uuid.uuid4().hex
+    if not tomar_lock(cache_key, token):
+        # Otra réplica está recalculando: esperar a que publique el valor o a que suelte el lock sin
+        # publicarlo (404, error de base), y en ese caso recalcular en cuanto se toma el lock
+        limite = time.monotonic() + CACHE_LOCK_ESPERA
+        while True:
+            if time.monotonic() >= limite:
+                return recalcular(cache_key, cargar)
+            time.sleep(0.05)
+            valor, _ = leer_cache(cache_key)
+            if valor is not None:
+                estadisticas_cache.contar("coalesced", cache_key)
+                return valor
+            if tomar_lock(cache_key, token):
+                break
+    try:
+        return recalcular(cache_key, cargar)
+    finally:
+        soltar_lock(cache_key, token)
+
+def refrescar_en_segundo_plano(cache_key: str, cargar):
+    """Stale-while-revalidate: un solo worker refresca la clave mientras se sirve el valor vencido"""
+    token = uuid.uuid4().hex
+    if not tomar_lock(cache_key, token):
+        return
+
+    def tarea():
+        try:
+            estadisticas_cache.contar("refresh", cache_key)
+            recalcular(cache_key, cargar)
+        except Exception as e:
+            log.error("Error al refrescar cache %s: %s", cache_key, e)
+        finally:
+            soltar_lock(cache_key, token)
+
+    _refrescos.submit(tarea)
+
+def obtener_con_cache(cache_key: str, cargar) -> bytes:
+    """Cache-aside L1 (proceso) + L2 (Redis) con single-flight, lock entre réplicas y stale-while-revalidate
+
+    Devuelve el cuerpo JSON final de la respuesta; en un acierto no se deserializa nada.
+    """
+    asegurar_suscripcion()
+    valor = cache_local.get(cache_key)
+    if valor is not None:
+        estadisticas_cache.contar("l1_hit", cache_key)
+        return valor
+
+    valor, ttl = leer_cache(cache_key)
+    if valor is not None:
+        if CACHE_STALE_TTL and ttl is not None and 0 <= ttl <= CACHE_STALE_TTL:
+            registrar_evento_cache(cache_key, "stale")
+            estadisticas_cache.contar("stale", cache_key)
+            refrescar_en_segundo_plano(cache_key, cargar)
+        else:
+            registrar_evento_cache(cache_key, "hit")
+            estadisticas_cache.contar("hit", cache_key)
+            cache_local.set(cache_key, valor)
+        return valor
+
+    registrar_evento_cache(cache_key, "miss")
+    estadisticas_cache.contar("miss", cache_key)
+
+    with _vuelos_lock:
+        vuelo = _vuelos.get(cache_key)
+        lider = vuelo is None
+        if lider:
+            vuelo = _vuelos[cache_key] = Future()
+
+    if not lider:
+        estadisticas_cache.contar("coalesced", cache_key)
+        return vuelo.result()
+
+    try:
+        valor = recalcular_con_lock(cache_key, cargar)
+        vuelo.set_result(valor)
+        return valor
+    except BaseException as e:
+        vuelo.set_exception(e)
+        raise
+    finally:
+        with _vuelos_lock:
+            del _vuelos[cache_key]
+
+# Configuración del pool de conexiones
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Segundos que una conexión puede estar inactiva antes de verificarla con SELECT 1. Por defecto se verifica
+# en cada checkout: con un margen, después de reiniciar Postgres cada conexión del pool falla una petición
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "0"))
+
+class PoolConexiones:
+    """Pool de conexiones PostgreSQL compartido con verificación y reconexión"""
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, check_idle: float, config: dict):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.config = config
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._ultimo_uso = {}
+        self.en_uso = 0
+        self.checkouts = 0
+        self.esperas = 0
+        self.timeouts = 0
+        self.reconexiones = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def _get_pool(self):
+        # Se crea de forma perezosa para que el servicio arranque aunque Postgres no esté listo
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        self.minconn, self.maxconn, cursor_factory=CursorMedido, **self.config
+                    )
+        return self._pool
+
+    def _conexion_valida(self, conn) -> bool:
+        if conn.closed:
+            return False
+        ultimo_uso = self._ultimo_uso.get(id(conn))
+        # Las que nunca se usaron también se verifican: el pool crea las primeras al arrancar
+        if ultimo_uso is not None and time.monotonic() - ultimo_uso < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        inicio = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolError(
+                f"No hay conexiones disponibles después de {self.timeout}s (máximo {self.maxconn})"
+            )
+        espera = time.monotonic() - inicio
+        try:
+            pool = self._get_pool()
+            conn = pool.getconn()
+            # Descartar conexiones rotas (p. ej. después de reiniciar Postgres)
+            while not self._conexion_valida(conn):
+                pool.putconn(conn, close=True)
+                self._ultimo_uso.pop(id(conn), None)
+                with self._lock:
+                    self.reconexiones += 1
+                conn = pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.en_uso += 1
+            self.checkouts += 1
+            if espera > 0.001:
+                self.esperas += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+        return conn
+
+    def putconn(self, conn):
+        cerrar = bool(conn.closed)
+        if not cerrar:
+            try:
+                # Devolver la conexión limpia, sin transacciones abiertas
+                conn.rollback()
+            except psycopg2.Error:
+                cerrar = True
+        if cerrar:
+            self._ultimo_uso.pop(id(conn), None)
+        else:
+            self._ultimo_uso[id(conn)] = time.monotonic()
+        try:
+            self._get_pool().putconn(conn, close=cerrar)
+        finally:
+            with self._lock:
+                self.en_uso -= 1
+            self._slots.release()
+
+    def cerrar(self):
+        """Cierra las conexiones del pool al terminar el worker"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def stats(self) -> dict:
+        idle = len(self._pool._pool) if self._pool is not None else 0
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "en_uso": self.en_uso,
+                "idle": idle,
+                "checkouts": self.checkouts,
+                "esperas": self.esperas,
+                "timeouts": self.timeouts,
+                "reconexiones": self.reconexiones,
+                "espera_promedio_ms": round(self.espera_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "espera_max_ms": round(self.espera_max * 1000, 3),
+            }
+
+db_pool = PoolConexiones(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE, DB_CONFIG)
+registrar_pool(db_pool.stats)
+
+def cerrar_conexiones():
+    """Libera el pool y los clientes de Redis del worker cuando termina de drenar"""
+    global redis_client, redis_raw
+    db_pool.cerrar()
+    for cliente in (redis_client, redis_raw):
+        if cliente is not None:
+            cliente.close()
+    redis_client = redis_raw = None
 
 @contextmanager
 def get_db_connection():
-    conn = psycopg2.connect(**DB_CONFIG)
+    with medir("db_conexion"):
+        conn = db_pool.getconn()
     try:
         yield conn
     finally:
-        conn.close()
+        db_pool.putconn(conn)
+
+# Catálogo columnar en memoria (opcional, requiere numpy)
+CATALOGO_MEMORIA = os.getenv("CATALOGO_MEMORIA", "0") == "1"
+CATALOGO_REFRESCO = float(os.getenv("CATALOGO_REFRESCO", "5"))
+
+catalogo = None
+if CATALOGO_MEMORIA:
+    from catalogo import CatalogoColumnar, ORDENES
+    catalogo = CatalogoColumnar(get_db_connection, CATALOGO_REFRESCO)
 
 class Producto(BaseModel):
     id: int
@@ -75,6 +740,26 @@ class ProductoResumen(BaseModel):
     stock: int
     marca: str
 
+class ProductoParcial(BaseModel):
+    """ProductoResumen proyectado con fields=: solo vienen las columnas pedidas"""
+    id: Optional[int] = None
+    nombre: Optional[str] = None
+    categoria: Optional[str] = None
+    precio: Optional[float] = None
+    stock: Optional[int] = None
+    marca: Optional[str] = None
+
+class PaginaProductos(BaseModel):
+    productos: List[ProductoParcial]
+    siguiente_cursor: Optional[str] = None
+
+class FilasProductos(BaseModel):
+    columnas: List[str]
+    filas: List[list]
+
+# Respuestas de GET /api/productos según limite/cursor, fields y formato
+ListaProductos = Union[List[ProductoResumen], List[ProductoParcial], PaginaProductos, FilasProductos]
+
 class ProductoCreate(BaseModel):
     nombre: str
     categoria: str
@@ -89,10 +774,55 @@ class ProductoResponse(BaseModel):
     message: str
     producto_id: Optional[int] = None
 
-def get_productos_from_db(categoria: Optional[str] = None):
-    """Obtiene productos de la base de datos"""
+# Límites de las columnas de productos: un valor fuera de rango haría fallar un COPY completo
+LONGITUDES_PRODUCTO = {"nombre": 200, "categoria": 100, "marca": 100, "imagen_url": 500}
+PRECIO_MAXIMO = 99999999.99
+STOCK_MAXIMO = 2**31 - 1
+
+def validar_producto(producto: ProductoCreate) -> Optional[str]:
+    """Reglas de un alta de producto (individual o importada); devuelve el mensaje de error o None"""
+    if not producto.precio > 0:
+        return "El precio debe ser mayor a 0"
+    if producto.stock < 0:
+        return "El stock no puede ser negativo"
+    if not producto.nombre.strip():
+        return "El nombre del producto es requerido"
+    if not producto.categoria.strip():
+        return "La categoría del producto es requerida"
+    if not producto.marca.strip():
+        return "La marca del producto es requerida"
+    if not math.isfinite(producto.precio) or producto.precio > PRECIO_MAXIMO:
+        return f"El precio no puede superar {PRECIO_MAXIMO}"
+    if producto.stock > STOCK_MAXIMO:
+        return f"El stock no puede superar {STOCK_MAXIMO}"
+    for campo, maximo in LONGITUDES_PRODUCTO.items():
+        valor = getattr(producto, campo)
+        if valor and len(valor.strip()) > maximo:
+            return f"El campo {campo} no puede superar {maximo} caracteres"
+    return None
+
+# DECIMAL(10,2) -> float al decodificar la fila, sin crear objetos Decimal intermedios
+DECIMAL_A_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "DECIMAL_A_FLOAT",
+    lambda valor, cur: float(valor) if valor is not None else None
+)
+
+@contextmanager
+def cursor_filas(conn):
+    """Cursor de tuplas (sin un dict por fila) que entrega los DECIMAL como float"""
+    with conn.cursor() as cur:
+        psycopg2.extensions.register_type(DECIMAL_A_FLOAT, cur)
+        yield cur
+
+def columnas_de(cur) -> List[str]:
+    """Cabecera única con los nombres de columna del último SELECT"""
+    return [col.name for col in cur.description]
+
+def get_filas_productos_from_db(categoria: Optional[str] = None) -> dict:
+    """Obtiene productos como una cabecera de columnas y filas en tuplas"""
     with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with cursor_filas(conn) as cur:
             if categoria:
                 cur.execute(
                     "SELECT id, nombre, categoria, precio, stock, marca FROM productos WHERE categoria = %s ORDER BY nombre",
@@ -101,7 +831,231 @@ def get_productos_from_db(categoria: Optional[str] = None):
             else:
                 cur.execute("SELECT id, nombre, categoria, precio, stock, marca FROM productos ORDER BY nombre")
             
-            return cur.fetchall()
+            return {"columnas": columnas_de(cur), "filas": cur.fetchall()}
+
+def get_productos_from_db(categoria: Optional[str] = None):
+    """Obtiene productos de la base de datos"""
+    datos = get_filas_productos_from_db(categoria)
+    columnas = datos["columnas"]
+    return [dict(zip(columnas, fila)) for fila in datos["filas"]]
+
+# Columnas que se pueden pedir con fields= (mismas que ProductoResumen)
+CAMPOS_PRODUCTO = ("id", "nombre", "categoria", "precio", "stock", "marca")
+
+def codificar_cursor(valores: list) -> str:
+    """Cursor opaco a partir de los valores de la clave de orden de la última fila"""
+    return base64.urlsafe_b64encode(orjson.dumps(valores)).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> tuple:
+    """(nombre, id) de la última fila de la página anterior; un cursor mal formado es un 400 y no llega a SQL"""
+    try:
+        nombre, ultimo_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError, orjson.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(nombre, str) or not isinstance(ultimo_id, int) or isinstance(ultimo_id, bool):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return nombre, ultimo_id
+
+def parsear_campos(fields: Optional[str]) -> List[str]:
+    """Valida la proyección pedida con fields=; sin proyección se devuelven todas las columnas"""
+    if not fields:
+        return list(CAMPOS_PRODUCTO)
+    campos = [campo.strip() for campo in fields.split(",") if campo.strip()]
+    invalidos = [campo for campo in campos if campo not in CAMPOS_PRODUCTO]
+    if invalidos or not campos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos inválidos: {', '.join(invalidos)}. Permitidos: {', '.join(CAMPOS_PRODUCTO)}"
+        )
+    return campos
+
+def get_pagina_productos_from_db(categoria: Optional[str], limite: int, cursor: Optional[tuple], campos: List[str]):
+    """Obtiene una página de productos ordenada por (nombre, id) usando paginación por keyset"""
+    # nombre e id siempre se consultan porque forman el cursor; los nombres de columna vienen de CAMPOS_PRODUCTO
+    columnas = list(dict.fromkeys(["nombre", "id"] + campos))
+    condiciones = []
+    parametros = []
+    if categoria:
+        condiciones.append("categoria = %s")
+        parametros.append(categoria)
+    if cursor:
+        condiciones.append("(nombre, id) > (%s, %s)")
+        parametros.extend(cursor)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    
+    with get_db_connection() as conn:
+        with cursor_filas(conn) as cur:
+            cur.execute(
+                f"SELECT {', '.join(columnas)} FROM productos {where} ORDER BY nombre, id LIMIT %s",
+                parametros + [limite + 1]
+            )
+            filas = cur.fetchall()
+    
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        # columnas empieza por nombre, id
+        siguiente = codificar_cursor([filas[-1][0], filas[-1][1]])
+    posiciones = [columnas.index(campo) for campo in campos]
+    return {
+        "productos": [{campo: fila[i] for campo, i in zip(campos, posiciones)} for fila in filas],
+        "siguiente_cursor": siguiente
+    }
+
+# Filas por lote al exportar con cursor del lado del servidor
+EXPORT_LOTE = int(os.getenv("EXPORT_LOTE", "2000"))
+
+def exportar_filas(sql: str, nombre_cursor: str, formato: str):
+    """Genera NDJSON o CSV por lotes desde un cursor con nombre (server-side), con memoria constante"""
+    with get_db_connection() as conn:
+        with conn.cursor(name=nombre_cursor) as cur:
+            cur.itersize = EXPORT_LOTE
+            cur.execute(sql)
+            columnas = None
+            while True:
+                filas = cur.fetchmany(EXPORT_LOTE)
+                if columnas is None:
+                    columnas = [col.name for col in cur.description]
+                    if formato == "csv":
+                        buffer = io.StringIO()
+                        csv.writer(buffer).writerow(columnas)
+                        yield buffer.getvalue().encode()
+                if not filas:
+                    break
+                if formato == "csv":
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(filas)
+                    yield buffer.getvalue().encode()
+                else:
+                    yield b"".join(serializar(dict(zip(columnas, fila))) + b"\n" for fila in filas)
+
+def respuesta_exportacion(filas, nombre: str, formato: str) -> StreamingResponse:
+    media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+    extension = "csv" if formato == "csv" else "ndjson"
+    return StreamingResponse(
+        filas,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}.{extension}"'}
+    )
+
+def normalizar_busqueda(q: Optional[str]) -> str:
+    """Normaliza el texto buscado para que consultas equivalentes compartan la clave de cache"""
+    return " ".join((q or "").lower().split())
+
+def buscar_productos_db(q: str, filtros: dict, limite: int):
+    """Búsqueda con ranking (tsvector + trigramas), filtros por índice y conteo de facetas"""
+    condiciones = []
+    parametros = []
+    if q:
+        # Coincidencia de texto completo sobre nombre/marca/descripción o nombre parecido (trigramas)
+        condiciones.append("(busqueda @@ websearch_to_tsquery('spanish', %s) OR nombre %% %s)")
+        parametros.extend([q, q])
+    # Solo se agregan los filtros presentes para que el planificador use idx_categoria/idx_marca/idx_precio
+    if filtros["categoria"]:
+        condiciones.append("categoria = %s")
+        parametros.append(filtros["categoria"])
+    if filtros["marca"]:
+        condiciones.append("marca = %s")
+        parametros.append(filtros["marca"])
+    if filtros["precio_min"] is not None:
+        condiciones.append("precio >= %s")
+        parametros.append(filtros["precio_min"])
+    if filtros["precio_max"] is not None:
+        condiciones.append("precio <= %s")
+        parametros.append(filtros["precio_max"])
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    
+    if q:
+        relevancia = "ts_rank_cd(busqueda, websearch_to_tsquery('spanish', %s)) + similarity(nombre, %s)"
+        parametros_relevancia = [q, q]
+    else:
+        relevancia = "0"
+        parametros_relevancia = []
+    
+    with get_db_connection() as conn:
+        with cursor_filas(conn) as cur:
+            cur.execute(
+                f"""
+                SELECT id, nombre, categoria, precio, stock, marca, {relevancia} AS relevancia
+                FROM productos
+                {where}
+                ORDER BY relevancia DESC, nombre, id
+                LIMIT %s
+                """,
+                parametros_relevancia + parametros + [limite]
+            )
+            columnas = columnas_de(cur)
+            resultados = [dict(zip(columnas, fila)) for fila in cur.fetchall()]
+            
+            # Facetas por categoría y marca sobre todo el conjunto filtrado, en una sola consulta
+            cur.execute(
+                f"""
+                SELECT categoria, marca, COUNT(*) AS cantidad
+                FROM productos
+                {where}
+                GROUP BY GROUPING SETS ((categoria), (marca))
+                """,
+                parametros
+            )
+            facetas = {"categoria": {}, "marca": {}}
+            for categoria, marca, cantidad in cur.fetchall():
+                if categoria is not None:
+                    facetas["categoria"][categoria] = cantidad
+                else:
+                    facetas["marca"][marca] = cantidad
+    
+    for fila in resultados:
+        fila["relevancia"] = round(float(fila["relevancia"]), 4)
+    return {
+        "query": q,
+        "total": sum(facetas["categoria"].values()),
+        "resultados": resultados,
+        "facetas": facetas
+    }
+
+def get_categorias_from_db():
+    """Obtiene las categorías distintas de la base de datos"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT categoria FROM productos ORDER BY categoria")
+            return {"categorias": [row[0] for row in cur.fetchall()]}
+
+def get_producto_from_db(producto_id: int):
+    """Obtiene el detalle de un producto, 404 si no existe"""
+    with get_db_connection() as conn:
+        with cursor_filas(conn) as cur:
+            cur.execute(
+                """
+                SELECT id, nombre, categoria, precio, stock, marca, descripcion, imagen_url 
+                FROM productos 
+                WHERE id = %s
+                """,
+                (producto_id,)
+            )
+            
+            producto = cur.fetchone()
+            
+            if not producto:
+                raise HTTPException(
+                    status_code=404, 
+                    detail=f"Producto con ID {producto_id} no encontrado"
+                )
+            return dict(zip(columnas_de(cur), producto))
+
+def get_productos_por_ids_from_db(producto_ids: List[int]) -> dict:
+    """Detalle de varios productos en una sola consulta, indexado por id (los inexistentes no aparecen)"""
+    with get_db_connection() as conn:
+        with cursor_filas(conn) as cur:
+            cur.execute(
+                """
+                SELECT id, nombre, categoria, precio, stock, marca, descripcion, imagen_url
+                FROM productos
+                WHERE id = ANY(%s)
+                """,
+                (producto_ids,)
+            )
+            columnas = columnas_de(cur)
+            return {fila[0]: dict(zip(columnas, fila)) for fila in cur.fetchall()}
 
 # Endpoints
 @app.get("/")
@@ -113,102 +1067,199 @@ def root():
 def root():
     return {"estado": "OK"}    
 
-@app.get("/api/productos", response_model=List[ProductoResumen])
-def listar_productos(categoria: Optional[str] = None):
-    """Lista todos los productos o filtra por categoría con cache Redis"""
-    try:
-        cache_key = f"productos:{'all' if not categoria else f'categoria:{categoria}'}"
+@app.get("/metrics")
+def metricas():
+    """Métricas en formato de exposición de Prometheus"""
+    cuerpo, media_type = respuesta_metricas()
+    return Response(content=cuerpo, media_type=media_type)
 
-        if redis_client:
-            try:
-                cached_data = redis_client.get(cache_key)
-                
-                if cached_data:
-                    print(f"✓ Cache HIT para: {cache_key}")
-                    return json.loads(cached_data)
-                
-                print(f"✗ Cache MISS para: {cache_key}")
-            except redis.RedisError as e:
-                print(f"Error al leer de Redis: {e}")
-        
-        productos = get_productos_from_db(categoria)
-        if redis_client:
-            try:
-                redis_client.setex(
-                    cache_key,
-                    CACHE_TTL,
-                    json.dumps(productos, default=str)
+@app.get("/api/pool/status")
+def pool_status():
+    """Estadísticas del pool de conexiones a PostgreSQL"""
+    return db_pool.stats()
+
+@app.get("/api/productos", response_model=ListaProductos)
+def listar_productos(
+    categoria: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    formato: str = Query("objetos", pattern="^(objetos|filas)$"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Lista todos los productos o filtra por categoría con cache Redis
+
+    Con `limite` (o `cursor`) la respuesta se pagina por (nombre, id) y se devuelve como
+    {"productos": [...], "siguiente_cursor": ...}; `fields` limita las columnas devueltas.
+    Con `formato=filas` la lista completa se devuelve como {"columnas": [...], "filas": [[...]]}.
+    """
+    try:
+        base = clave_listas('all' if not categoria else f'categoria:{categoria}')
+        if limite is None and cursor is None and fields is None:
+            if formato == "filas":
+                # Cabecera única + filas en arrays: se serializan las tuplas tal cual llegan del cursor
+                cache_key = f"{base}:filas"
+                return respuesta_condicional(
+                    cache_key, obtener_con_cache(cache_key, lambda: get_filas_productos_from_db(categoria)), if_none_match
                 )
-                print(f"✓ Datos guardados en cache: {cache_key}")
-            except redis.RedisError as e:
-                print(f"Error al guardar en Redis: {e}")
+            cache_key = base
+            return respuesta_condicional(
+                cache_key, obtener_con_cache(cache_key, lambda: get_productos_from_db(categoria)), if_none_match
+            )
         
-        return productos
-                
+        campos = parsear_campos(fields)
+        if limite is None and cursor is None:
+            # Solo proyección, sin paginar
+            cache_key = f"{base}:f:{','.join(campos)}"
+            return respuesta_condicional(cache_key, obtener_con_cache(
+                cache_key,
+                lambda: [{campo: fila[campo] for campo in campos} for fila in get_productos_from_db(categoria)]
+            ), if_none_match)
+        
+        limite = limite or 50
+        posicion = decodificar_cursor(cursor) if cursor else None
+        cache_key = f"{base}:p:{limite}:{cursor or 'inicio'}:f:{','.join(campos)}"
+        return respuesta_condicional(cache_key, obtener_con_cache(
+            cache_key,
+            lambda: get_pagina_productos_from_db(categoria, limite, posicion, campos)
+        ), if_none_match)
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener productos: {str(e)}")
 
+@app.get("/api/productos/export")
+def exportar_productos(formato: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """Exporta el catálogo completo en streaming (NDJSON o CSV) sin cargarlo en memoria"""
+    sql = """
+        SELECT id, nombre, categoria, precio, stock, marca, descripcion, imagen_url, created_at
+        FROM productos
+        ORDER BY id
+    """
+    return respuesta_exportacion(exportar_filas(sql, "export_productos", formato), "productos", formato)
+
+@app.get("/api/productos/search")
+def buscar_productos(
+    q: Optional[str] = None,
+    categoria: Optional[str] = None,
+    marca: Optional[str] = None,
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    limite: int = Query(20, ge=1, le=100)
+):
+    """Búsqueda de productos por texto con ranking, similitud, filtros de precio y facetas"""
+    try:
+        if precio_min is not None and precio_max is not None and precio_min > precio_max:
+            raise HTTPException(status_code=400, detail="precio_min no puede ser mayor que precio_max")
+        
+        texto = normalizar_busqueda(q)
+        filtros = {
+            "categoria": categoria.strip() if categoria else None,
+            "marca": marca.strip() if marca else None,
+            "precio_min": precio_min,
+            "precio_max": precio_max,
+        }
+        # Cache por consulta normalizada, en el namespace de listas (se invalida junto con ellas)
+        firma = orjson.dumps({"q": texto, "limite": limite, **filtros}, option=orjson.OPT_SORT_KEYS)
+        cache_key = clave_listas(f"search:{hashlib.sha1(firma).hexdigest()}")
+        return respuesta_json(obtener_con_cache(cache_key, lambda: buscar_productos_db(texto, filtros, limite)))
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al buscar productos: {str(e)}")
+
+@app.get("/api/productos/filtrar")
+def filtrar_productos(
+    categoria: Optional[str] = None,
+    marca: Optional[str] = None,
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    con_stock: bool = False,
+    orden: str = "nombre",
+    limite: int = Query(50, ge=1, le=500),
+    desplazamiento: int = Query(0, ge=0)
+):
+    """Filtra y ordena el catálogo desde el snapshot columnar en memoria"""
+    if catalogo is None:
+        raise HTTPException(status_code=503, detail="El catálogo en memoria no está habilitado (CATALOGO_MEMORIA=1)")
+    if orden not in ORDENES:
+        raise HTTPException(status_code=400, detail=f"Orden inválido. Permitidos: {', '.join(ORDENES)}")
+    try:
+        catalogo.iniciar()
+        if not catalogo.actualizaciones:
+            # Primera consulta del worker: esperar la carga inicial
+            catalogo.refrescar()
+        return respuesta_json(serializar(catalogo.consultar(
+            categoria, marca, precio_min, precio_max, con_stock, orden, limite, desplazamiento
+        )))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al filtrar productos: {str(e)}")
+
+@app.get("/api/catalogo/status")
+def catalogo_status():
+    """Estado del snapshot columnar del catálogo"""
+    if catalogo is None:
+        return {"status": "disabled"}
+    return {"status": "enabled", **catalogo.stats()}
+
 @app.get("/api/categorias")
-def listar_categorias():
+def listar_categorias(if_none_match: Optional[str] = Header(None)):
     """Lista todas las categorías disponibles"""
     try:
         cache_key = "categorias:all"
-        
-        # Intentar obtener del cache
-        if redis_client:
-            try:
-                cached_data = redis_client.get(cache_key)
-                if cached_data:
-                    print(f"✓ Cache HIT para categorías")
-                    return json.loads(cached_data)
-            except redis.RedisError as e:
-                print(f"Error al leer categorías de Redis: {e}")
-        
-        # Consultar base de datos
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT DISTINCT categoria FROM productos ORDER BY categoria")
-                categorias = [row['categoria'] for row in cur.fetchall()]
-                resultado = {"categorias": categorias}
-                
-                # Guardar en cache
-                if redis_client:
-                    try:
-                        redis_client.setex(cache_key, CACHE_TTL, json.dumps(resultado))
-                        print(f"✓ Categorías guardadas en cache")
-                    except redis.RedisError as e:
-                        print(f"Error al guardar categorías en Redis: {e}")
-                
-                return resultado
+        return respuesta_condicional(
+            cache_key, obtener_con_cache(cache_key, get_categorias_from_db), if_none_match, CACHE_HTTP_MAX_AGE_CATEGORIAS
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener categorías: {str(e)}")
 
-def invalidar_cache_productos(categoria: Optional[str] = None):
-    """Invalida el caché de productos"""
+def publicar_invalidacion(claves: Optional[List[str]] = None, generacion: Optional[int] = None):
+    """Invalida el L1 propio y anuncia la invalidación (y la generación nueva de las listas) a las demás réplicas"""
+    if claves is None:
+        cache_local.clear()
+    else:
+        cache_local.delete(claves)
+    if redis_client:
+        if generacion is not None:
+            mensaje = json.dumps({"claves": claves, "generacion": generacion})
+        else:
+            mensaje = "*" if claves is None else json.dumps(claves)
+        redis_client.publish(CANAL_INVALIDACIONES, mensaje)
+
+def invalidar_cache_productos(producto_ids: Optional[List[int]] = None, categorias_cambiaron: bool = False):
+    """Invalida el caché de productos (L1 y Redis) sin recorrer el keyspace"""
     if not redis_client:
+        cache_local.clear()
         return
     
     try:
-        if categoria:
-            # Invalidar solo la categoría específica
-            redis_client.delete(f"productos:categoria:{categoria}")
-            redis_client.delete("productos:all")  # También invalidar la lista completa
-            print(f"✓ Cache invalidado para categoría: {categoria}")
+        if categorias_cambiaron or producto_ids:
+            # Las listas (con todas sus páginas, proyecciones y búsquedas) pasan a una generación nueva en O(1),
+            # los detalles se borran por clave
+            generacion = generacion_listas.invalidar()
+            claves = [f"producto:{producto_id}" for producto_id in producto_ids or []]
+            if categorias_cambiaron:
+                claves.append("categorias:all")
+            total = redis_client.delete(*claves) if claves else 0
+            publicar_invalidacion(claves + ["productos:*"], generacion)
+            log.info("Cache invalidado: listas de productos (generación %d) y %d claves", generacion, total)
         else:
-            # Invalidar todos los cachés de productos
-            keys = redis_client.keys("productos:*")
-            if keys:
-                redis_client.delete(*keys)
-            redis_client.delete("categorias:all")  # También invalidar categorías
-            print(f"✓ Cache invalidado completamente ({len(keys)} claves)")
+            # Invalidar todos los cachés de productos: índices por namespace y generación de las listas
+            generacion = generacion_listas.invalidar()
+            total = sum(invalidar_indice(keys=[indice]) for indice in CACHE_INDICES)
+            publicar_invalidacion(generacion=generacion)
+            log.info("Cache invalidado completamente (%d claves, listas en generación %d)", total, generacion)
     except redis.RedisError as e:
-        print(f"Error al invalidar caché: {str(e)}")
+        cache_local.clear()
+        log.error("Error al invalidar caché: %s", e)
 
 @app.get("/api/redis/status")
 def redis_status():
     """Verifica el estado de la conexión a Redis"""
     if not redis_client:
-        return {"status": "disconnected", "message": "Redis no está configurado"}
+        return {"status": "disconnected", "message": "Redis no está configurado", "cache": estadisticas_cache.snapshot()}
     
     try:
         redis_client.ping()
@@ -217,10 +1268,12 @@ def redis_status():
             "status": "connected",
             "redis_version": info.get("redis_version"),
             "used_memory_human": info.get("used_memory_human"),
-            "connected_clients": info.get("connected_clients")
+            "connected_clients": info.get("connected_clients"),
+            "cache": estadisticas_cache.snapshot(),
+            "l1": cache_local.stats()
         }
     except redis.RedisError as e:
-        return {"status": "error", "message": str(e)}
+        return {"status": "error", "message": str(e), "cache": estadisticas_cache.snapshot()}
 
 @app.post("/api/redis/clear")
 def clear_cache():
@@ -239,18 +1292,13 @@ def registrar_producto(producto: ProductoCreate):
     """Registra un nuevo producto en la base de datos"""
     try:
         # Validar datos
-        if producto.precio <= 0:
-            raise HTTPException(status_code=400, detail="El precio debe ser mayor a 0")
-        
-        if producto.stock < 0:
-            raise HTTPException(status_code=400, detail="El stock no puede ser negativo")
-        
-        if not producto.nombre.strip():
-            raise HTTPException(status_code=400, detail="El nombre del producto es requerido")
+        error = validar_producto(producto)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
         
         # Insertar producto en la base de datos
         with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            with conn.cursor() as cur:
                 # Verificar si ya existe un producto con el mismo nombre
                 cur.execute(
                     "SELECT id FROM productos WHERE LOWER(nombre) = LOWER(%s)",
@@ -280,13 +1328,30 @@ def registrar_producto(producto: ProductoCreate):
                     )
                 )
                 
-                nuevo_id = cur.fetchone()['id']
+                nuevo_id = cur.fetchone()[0]
                 conn.commit()
                 
-                print(f"✓ Producto registrado con ID: {nuevo_id}")
+                log.info("Producto registrado con ID: %s", nuevo_id)
                 
-                # Invalidar cache después de crear el producto
-                invalidar_cache_productos(producto.categoria)
+                # Invalidar las listas afectadas después de crear el producto
+                # Un producto nuevo puede agregar una categoría
+                invalidar_cache_productos(categorias_cambiaron=True)
+                
+                # Write-through: el detalle del nuevo producto se guarda directamente en cache
+                if redis_client:
+                    try:
+                        guardar_en_cache(f"producto:{nuevo_id}", serializar({
+                            "id": nuevo_id,
+                            "nombre": producto.nombre.strip(),
+                            "categoria": producto.categoria.strip(),
+                            "precio": round(producto.precio, 2),
+                            "stock": producto.stock,
+                            "marca": producto.marca.strip(),
+                            "descripcion": producto.descripcion.strip() if producto.descripcion else None,
+                            "imagen_url": producto.imagen_url
+                        }))
+                    except redis.RedisError as e:
+                        log.error("Error al guardar en Redis: %s", e)
                 
                 return ProductoResponse(
                     success=True,
@@ -297,63 +1362,313 @@ def registrar_producto(producto: ProductoCreate):
     except HTTPException:
         raise
     except psycopg2.Error as e:
-        print(f"Error de base de datos: {e}")
+        log.error("Error de base de datos: %s", e)
         raise HTTPException(
             status_code=500, 
             detail=f"Error al registrar el producto en la base de datos: {str(e)}"
         )
     except Exception as e:
-        print(f"Error inesperado: {e}")
+        log.exception("Error inesperado: %s", e)
         raise HTTPException(
             status_code=500, 
             detail=f"Error inesperado al registrar el producto: {str(e)}"
         )
 
+# Importación masiva: tamaño máximo del cuerpo, parte que se mantiene en memoria y errores devueltos
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+IMPORT_MEMORIA = 8 * 1024 * 1024
+IMPORT_MAX_ERRORES = int(os.getenv("IMPORT_MAX_ERRORES", "1000"))
+# Con más productos actualizados que esto se invalida todo el cache en lugar de clave por clave
+IMPORT_INVALIDAR_DETALLE_MAX = 1000
+COLUMNAS_IMPORT = ("nombre", "categoria", "precio", "stock", "marca", "descripcion", "imagen_url")
+
+def leer_filas_import(archivo, formato: str):
+    """Genera (línea, datos) desde el cuerpo NDJSON o CSV; si la fila no se puede leer, datos es el error"""
+    if formato == "ndjson":
+        for linea, contenido in enumerate(archivo, 1):
+            if not contenido.strip():
+                continue
+            try:
+                yield linea, orjson.loads(contenido)
+            except orjson.JSONDecodeError:
+                yield linea, "JSON inválido"
+        return
+
+    lector = csv.DictReader(io.TextIOWrapper(archivo, encoding="utf-8-sig", newline=""))
+    faltantes = {"nombre", "categoria", "precio", "stock", "marca"} - set(lector.fieldnames or ())
+    if faltantes:
+        raise HTTPException(status_code=400, detail=f"Faltan columnas en el CSV: {', '.join(sorted(faltantes))}")
+    # Línea donde empieza cada registro (un campo entre comillas puede ocupar varias)
+    inicio = lector.line_num + 1
+    for fila in lector:
+        # Celdas vacías = campo ausente (None en los opcionales, error en los requeridos)
+        yield inicio, {campo: valor for campo, valor in fila.items() if campo in COLUMNAS_IMPORT and valor != ""}
+        inicio = lector.line_num + 1
+
+def validar_fila_import(datos):
+    """Valida una fila con ProductoCreate y las reglas del alta individual; devuelve (producto, error)"""
+    try:
+        producto = ProductoCreate.model_validate(datos)
+    except ValidationError as e:
+        return None, "; ".join(
+            f"{'.'.join(map(str, error['loc']))}: {error['msg']}" if error["loc"] else error["msg"]
+            for error in e.errors()
+        )
+    return producto, validar_producto(producto)
+
+def importar_productos_db(archivo, formato: str, duplicados: str) -> dict:
+    """Valida las filas, las carga con COPY en una tabla temporal y aplica altas/actualizaciones en una transacción"""
+    errores = {}
+    nombres = {}
+
+    def registrar_error(linea, mensaje):
+        errores.setdefault(linea, mensaje)
+
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_MEMORIA, mode="w+", newline="") as copia:
+        escritor = csv.writer(copia)
+        for linea, datos in leer_filas_import(archivo, formato):
+            if isinstance(datos, str):
+                registrar_error(linea, datos)
+                continue
+            producto, error = validar_fila_import(datos)
+            if error:
+                registrar_error(linea, error)
+                continue
+            nombre = producto.nombre.strip()
+            # Duplicados dentro del archivo: gana la primera aparición
+            previa = nombres.setdefault(nombre.lower(), linea)
+            if previa != linea:
+                registrar_error(linea, f"Nombre repetido en el archivo (línea {previa})")
+                continue
+            escritor.writerow((
+                linea,
+                nombre,
+                producto.categoria.strip(),
+                producto.precio,
+                producto.stock,
+                producto.marca.strip(),
+                (producto.descripcion.strip() or None) if producto.descripcion else None,
+                producto.imagen_url or None,
+            ))
+
+        insertados, actualizados, omitidos = 0, [], set()
+        if nombres:
+            copia.seek(0)
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    # Un import a la vez: la detección de duplicados contra la tabla no compite con otro import
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext('productos_import'))")
+                    cur.execute(
+                        """
+                        CREATE TEMP TABLE productos_import (
+                            linea INTEGER PRIMARY KEY,
+                            nombre VARCHAR(200) NOT NULL,
+                            categoria VARCHAR(100) NOT NULL,
+                            precio DECIMAL(10, 2) NOT NULL,
+                            stock INTEGER NOT NULL,
+                            marca VARCHAR(100) NOT NULL,
+                            descripcion TEXT,
+                            imagen_url VARCHAR(500)
+                        ) ON COMMIT DROP
+                        """
+                    )
+                    with medir("db_consulta"):
+                        cur.copy_expert(
+                            "COPY productos_import (linea, nombre, categoria, precio, stock, marca, descripcion, imagen_url) "
+                            "FROM STDIN WITH (FORMAT csv)",
+                            copia
+                        )
+
+                    if duplicados == "omitir":
+                        cur.execute(
+                            """
+                            DELETE FROM productos_import i
+                            USING productos p
+                            WHERE LOWER(p.nombre) = LOWER(i.nombre)
+                            RETURNING i.linea, p.id
+                            """
+                        )
+                        for linea, producto_id in cur.fetchall():
+                            omitidos.add(linea)
+                            registrar_error(linea, f"Ya existe un producto con ese nombre (id {producto_id})")
+                    else:
+                        # Solo se reescriben las filas que cambian: re-importar el mismo catálogo no toca nada
+                        cur.execute(
+                            """
+                            UPDATE productos p
+                            SET categoria = i.categoria, precio = i.precio, stock = i.stock, marca = i.marca,
+                                descripcion = i.descripcion, imagen_url = i.imagen_url
+                            FROM productos_import i
+                            WHERE LOWER(p.nombre) = LOWER(i.nombre)
+                              AND (p.categoria, p.precio, p.stock, p.marca, p.descripcion, p.imagen_url)
+                                  IS DISTINCT FROM (i.categoria, i.precio, i.stock, i.marca, i.descripcion, i.imagen_url)
+                            RETURNING p.id
+                            """
+                        )
+                        actualizados = [fila[0] for fila in cur.fetchall()]
+
+                    cur.execute(
+                        """
+                        INSERT INTO productos (nombre, categoria, precio, stock, marca, descripcion, imagen_url)
+                        SELECT nombre, categoria, precio, stock, marca, descripcion, imagen_url
+                        FROM productos_import i
+                        WHERE NOT EXISTS (SELECT 1 FROM productos p WHERE LOWER(p.nombre) = LOWER(i.nombre))
+                        ORDER BY linea
+                        """
+                    )
+                    insertados = cur.rowcount
+                conn.commit()
+
+    if insertados or actualizados:
+        # Una sola invalidación para todo el import
+        if len(actualizados) > IMPORT_INVALIDAR_DETALLE_MAX:
+            invalidar_cache_productos()
+        else:
+            # Las filas nuevas o reescritas pueden agregar o mover categorías
+            invalidar_cache_productos(actualizados, categorias_cambiaron=True)
+        borrar_contadores_stock(actualizados)
+
+    log.info(
+        "Importación de productos",
+        extra={"campos": {"insertados": insertados, "actualizados": len(actualizados), "errores": len(errores)}}
+    )
+    return {
+        "success": True,
+        "insertados": insertados,
+        "actualizados": len(actualizados),
+        "sin_cambios": len(nombres) - len(omitidos) - insertados - len(actualizados),
+        "total_errores": len(errores),
+        "errores": [{"linea": linea, "error": errores[linea]} for linea in sorted(errores)[:IMPORT_MAX_ERRORES]],
+    }
+
+def borrar_contadores_stock(producto_ids: List[int]):
+    """El stock se fijó en la base: service2 recrea sus contadores de Redis desde productos.stock"""
+    if not redis_client or not producto_ids:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for i in range(0, len(producto_ids), 1000):
+            pipe.unlink(*[f"stock:{producto_id}" for producto_id in producto_ids[i:i + 1000]])
+        pipe.execute()
+    except redis.RedisError as e:
+        log.error("Error al borrar contadores de stock: %s", e)
+
+@app.post("/api/productos/import")
+async def importar_productos(
+    request: Request,
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    duplicados: str = Query("actualizar", pattern="^(actualizar|omitir)$")
+):
+    """Importa productos en bloque desde NDJSON o CSV con las mismas columnas que POST /api/productos
+
+    Los productos cuyo nombre ya existe (sin distinguir mayúsculas) se actualizan, o se reportan como
+    error con `duplicados=omitir`. Las filas inválidas vuelven en `errores` con su número de línea.
+    """
+    # El cuerpo se recibe en streaming a un archivo temporal que pasa a disco si es grande
+    cuerpo = tempfile.SpooledTemporaryFile(max_size=IMPORT_MEMORIA)
+    try:
+        tamano = 0
+        async for bloque in request.stream():
+            tamano += len(bloque)
+            if tamano > IMPORT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"El archivo supera {IMPORT_MAX_BYTES} bytes")
+            cuerpo.write(bloque)
+        cuerpo.seek(0)
+        return await run_in_threadpool(importar_productos_db, cuerpo, formato, duplicados)
+    except HTTPException:
+        raise
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El archivo debe estar codificado en UTF-8")
+    except psycopg2.Error as e:
+        log.error("Error de base de datos: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error al importar productos: {str(e)}")
+    finally:
+        cuerpo.close()
+
+# Máximo de ids por petición de /api/productos/batch
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "100"))
+
+def parsear_ids(ids: str) -> List[int]:
+    """'3,1,3' -> [3, 1]: sin repetidos y en el orden pedido"""
+    try:
+        producto_ids = list(dict.fromkeys(int(parte) for parte in ids.split(",") if parte.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas")
+    if not producto_ids:
+        raise HTTPException(status_code=400, detail="Se requiere al menos un id")
+    if len(producto_ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Se permiten como máximo {BATCH_MAX_IDS} ids")
+    return producto_ids
+
+@app.get("/api/productos/batch")
+def obtener_productos_batch(ids: str = Query(..., description="Ids de producto separados por comas")):
+    """Detalle de varios productos en una petición (carrito, comparador)
+
+    Usa las mismas claves producto:{id} que el detalle individual: L1, un MGET a Redis, una consulta
+    para los que falten y un solo pipeline para guardarlos. Devuelve {"productos": [...], "no_encontrados": [...]}.
+    """
+    try:
+        producto_ids = parsear_ids(ids)
+        asegurar_suscripcion()
+        cuerpos = {}
+        pendientes = []
+        for producto_id in producto_ids:
+            cache_key = f"producto:{producto_id}"
+            valor = cache_local.get(cache_key)
+            if valor is not None:
+                estadisticas_cache.contar("l1_hit", cache_key)
+                cuerpos[producto_id] = valor
+            else:
+                pendientes.append(producto_id)
+        
+        faltantes = []
+        if pendientes:
+            valores = leer_cache_varias([f"producto:{producto_id}" for producto_id in pendientes])
+            for producto_id, valor in zip(pendientes, valores):
+                cache_key = f"producto:{producto_id}"
+                if valor is None:
+                    estadisticas_cache.contar("miss", cache_key)
+                    faltantes.append(producto_id)
+                    continue
+                # Sin TTL en el MGET: un valor en ventana stale se sirve y lo refresca el detalle individual
+                estadisticas_cache.contar("hit", cache_key)
+                cache_local.set(cache_key, valor)
+                cuerpos[producto_id] = valor
+        
+        if faltantes:
+            nuevos = {
+                f"producto:{producto_id}": serializar(producto)
+                for producto_id, producto in get_productos_por_ids_from_db(faltantes).items()
+            }
+            if nuevos and redis_client:
+                try:
+                    guardar_varias_en_cache(nuevos)
+                except redis.RedisError as e:
+                    log.error("Error al guardar en Redis: %s", e)
+            for cache_key, valor in nuevos.items():
+                cache_local.set(cache_key, valor)
+                cuerpos[int(cache_key.split(":", 1)[1])] = valor
+        
+        # Los cuerpos cacheados se concatenan tal cual, sin deserializarlos
+        encontrados = [cuerpos[producto_id] for producto_id in producto_ids if producto_id in cuerpos]
+        no_encontrados = [producto_id for producto_id in producto_ids if producto_id not in cuerpos]
+        return respuesta_json(
+            b'{"productos":[' + b",".join(encontrados) + b'],"no_encontrados":' + serializar(no_encontrados) + b"}"
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener productos: {str(e)}")
+
 @app.get("/api/productos/{producto_id}", response_model=Producto)
-def obtener_producto(producto_id: int):
+def obtener_producto(producto_id: int, if_none_match: Optional[str] = Header(None)):
     """Obtiene un producto específico por su ID"""
     try:
         cache_key = f"producto:{producto_id}"
-        
-        # Intentar obtener del cache
-        if redis_client:
-            try:
-                cached_data = redis_client.get(cache_key)
-                if cached_data:
-                    print(f"✓ Cache HIT para producto ID: {producto_id}")
-                    return json.loads(cached_data)
-            except redis.RedisError as e:
-                print(f"Error al leer de Redis: {e}")
-        
-        # Consultar base de datos
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(
-                    """
-                    SELECT id, nombre, categoria, precio, stock, marca, descripcion, imagen_url 
-                    FROM productos 
-                    WHERE id = %s
-                    """,
-                    (producto_id,)
-                )
-                
-                producto = cur.fetchone()
-                
-                if not producto:
-                    raise HTTPException(
-                        status_code=404, 
-                        detail=f"Producto con ID {producto_id} no encontrado"
-                    )
-                
-                # Guardar en cache
-                if redis_client:
-                    try:
-                        redis_client.setex(cache_key, CACHE_TTL, json.dumps(producto, default=str))
-                        print(f"✓ Producto ID {producto_id} guardado en cache")
-                    except redis.RedisError as e:
-                        print(f"Error al guardar en Redis: {e}")
-                
-                return producto
+        return respuesta_condicional(
+            cache_key, obtener_con_cache(cache_key, lambda: get_producto_from_db(producto_id)), if_none_match
+        )
                 
     except HTTPException:
         raise
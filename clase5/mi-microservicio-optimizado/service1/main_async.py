@@ -0,0 +1,346 @@
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from typing import Optional
+from contextlib import asynccontextmanager
+import asyncpg
+import redis.asyncio as aioredis
+import redis
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+# Se reutilizan la configuración, los modelos y los endpoints de escritura del modo síncrono
+from main import app as app_sync, listar_productos as listar_productos_sync, exportar_productos, buscar_productos, filtrar_productos
+from main import obtener_productos_batch
+from main import DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, Producto, ListaProductos
+from main import CACHE_TTL, CACHE_STALE_TTL, CACHE_LOCK_TTL_MS, CACHE_LOCK_ESPERA, LUA_LIBERAR_LOCK
+from main import indice_cache, clave_listas, generacion_listas, CACHE_GENERACION_LISTAS, estadisticas_cache, cache_local, asegurar_suscripcion, serializar
+from main import respuesta_condicional, CACHE_HTTP_MAX_AGE_CATEGORIAS
+from main import conectar_redis, cerrar_conexiones
+from metricas import MiddlewareMetricas, medir
+from registro import MiddlewareRequestId, registrar_evento_cache
+
+log = logging.getLogger("productos")
+
+db_pool: Optional[asyncpg.Pool] = None
+redis_client: Optional[aioredis.Redis] = None
+
+# Vuelos en curso por clave y tareas de refresco en segundo plano
+_vuelos = {}
+_tareas = set()
+
+async def configurar_conexion(conn):
+    """DECIMAL -> float al decodificar, igual que DECIMAL_A_FLOAT en el modo síncrono"""
+    await conn.set_type_codec("numeric", encoder=str, decoder=float, schema="pg_catalog", format="text")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crea el pool de asyncpg y el cliente de Redis asíncrono al iniciar"""
+    global db_pool, redis_client
+    # La app síncrona está montada y su lifespan no se ejecuta: sus clientes se crean aquí
+    conectar_redis()
+    db_pool = await asyncpg.create_pool(
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        timeout=DB_POOL_TIMEOUT,
+        init=configurar_conexion,
+        **DB_CONFIG
+    )
+    try:
+        redis_client = aioredis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            db=0,
+            # Sin decodificación: el cache guarda los cuerpos de respuesta ya serializados
+            socket_connect_timeout=5,
+            socket_timeout=5
+        )
+        await redis_client.ping()
+        log.info("Conectado a Redis (asyncio)")
+    except redis.RedisError as e:
+        log.warning("No se pudo conectar a Redis: %s", e)
+        redis_client = None
+    yield
+    if redis_client:
+        await redis_client.close()
+    await db_pool.close()
+    cerrar_conexiones()
+
+app = FastAPI(title="Tienda Hardware API - Productos (async)", lifespan=lifespan)
+
+# Configurar CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(MiddlewareMetricas)
+app.add_middleware(MiddlewareRequestId)
+
+async def leer_cache(cache_key: str):
+    """Devuelve (bytes, ttl restante) de una clave, o (None, None) si no existe o Redis falla"""
+    if not redis_client:
+        return None, None
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(cache_key)
+        pipe.ttl(cache_key)
+        with medir("redis_get"):
+            valor, ttl = await pipe.execute()
+        return valor, ttl
+    except redis.RedisError as e:
+        log.error("Error al leer de Redis: %s", e)
+        return None, None
+
+async def cache_set(cache_key: str, valor: bytes):
+    """Guarda un cuerpo serializado en el cache y registra la clave en el índice de su namespace"""
+    if not redis_client:
+        return
+    try:
+        indice = indice_cache(cache_key)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.setex(cache_key, CACHE_TTL + CACHE_STALE_TTL, valor)
+        if indice:
+            pipe.sadd(indice, cache_key)
+            pipe.expire(indice, CACHE_TTL + CACHE_STALE_TTL)
+        with medir("redis_set"):
+            await pipe.execute()
+        log.debug("Datos guardados en cache", extra={"campos": {"clave": cache_key}})
+    except redis.RedisError as e:
+        log.error("Error al guardar en Redis: %s", e)
+
+async def generacion_listas_actual() -> int:
+    """Como GeneracionListas.actual, pero sin valor local la lee con el cliente asyncio y no bloquea el loop"""
+    valor = generacion_listas.local()
+    if valor is not None:
+        return valor
+    if not redis_client:
+        return 0
+    try:
+        with medir("redis_get"):
+            return int(await redis_client.get(CACHE_GENERACION_LISTAS) or 0)
+    except redis.RedisError as e:
+        log.error("Error al leer la generación de las listas: %s", e)
+        return 0
+
+async def tomar_lock(cache_key: str, token: str) -> bool:
+    """Intenta tomar el lock de recálculo de una clave (compartido con las réplicas síncronas)"""
+    if not redis_client:
+        return True
+    try:
+        return bool(await redis_client.set(f"lock:{cache_key}", token, nx=True, px=CACHE_LOCK_TTL_MS))
+    except redis.RedisError:
+        return True
+
+async def soltar_lock(cache_key: str, token: str):
+    if not redis_client:
+        return
+    try:
+        await redis_client.eval(LUA_LIBERAR_LOCK, 1, f"lock:{cache_key}", token)
+    except redis.RedisError as e:
+        log.error("Error al liberar lock de cache: %s", e)
+
+async def recalcular(cache_key: str, cargar):
+    valor = serializar(await cargar())
+    await cache_set(cache_key, valor)
+    cache_local.set(cache_key, valor)
+    return valor
+
+async def recalcular_con_lock(cache_key: str, cargar):
+    """Recalcula una clave: solo una réplica consulta la base, las demás esperan el resultado"""
+    token = uuid.uuid4().hex
+    if not await tomar_lock(cache_key, token):
+        # Si quien tenía el lock lo suelta sin publicar el valor, se recalcula sin esperar al límite
+        limite = time.monotonic() + CACHE_LOCK_ESPERA
+        while True:
+            if time.monotonic() >= limite:
+                return await recalcular(cache_key, cargar)
+            await asyncio.sleep(0.05)
+            valor, _ = await leer_cache(cache_key)
+            if valor is not None:
+                estadisticas_cache.contar("coalesced", cache_key)
+                return valor
+            if await tomar_lock(cache_key, token):
+                break
+    try:
+        return await recalcular(cache_key, cargar)
+    finally:
+        await soltar_lock(cache_key, token)
+
+async def refrescar(cache_key: str, cargar, token: str):
+    try:
+        estadisticas_cache.contar("refresh", cache_key)
+        await recalcular(cache_key, cargar)
+    except Exception as e:
+        log.error("Error al refrescar cache %s: %s", cache_key, e)
+    finally:
+        await soltar_lock(cache_key, token)
+
+async def obtener_con_cache(cache_key: str, cargar):
+    """Cache-aside L1 (proceso) + L2 (Redis) con single-flight, lock entre réplicas y stale-while-revalidate"""
+    asegurar_suscripcion()
+    valor = cache_local.get(cache_key)
+    if valor is not None:
+        estadisticas_cache.contar("l1_hit", cache_key)
+        return valor
+
+    valor, ttl = await leer_cache(cache_key)
+    if valor is not None:
+        if CACHE_STALE_TTL and ttl is not None and 0 <= ttl <= CACHE_STALE_TTL:
+            registrar_evento_cache(cache_key, "stale")
+            estadisticas_cache.contar("stale", cache_key)
+            token = uuid.uuid4().hex
+            if await tomar_lock(cache_key, token):
+                tarea = asyncio.create_task(refrescar(cache_key, cargar, token))
+                _tareas.add(tarea)
+                tarea.add_done_callback(_tareas.discard)
+        else:
+            registrar_evento_cache(cache_key, "hit")
+            estadisticas_cache.contar("hit", cache_key)
+            cache_local.set(cache_key, valor)
+        return valor
+
+    registrar_evento_cache(cache_key, "miss")
+    estadisticas_cache.contar("miss", cache_key)
+
+    vuelo = _vuelos.get(cache_key)
+    if vuelo is not None:
+        estadisticas_cache.contar("coalesced", cache_key)
+        return await asyncio.shield(vuelo)
+
+    vuelo = _vuelos[cache_key] = asyncio.get_running_loop().create_future()
+    try:
+        valor = await recalcular_con_lock(cache_key, cargar)
+        vuelo.set_result(valor)
+        return valor
+    except BaseException as e:
+        vuelo.set_exception(e)
+        vuelo.exception()  # marcar como leída si nadie más la espera
+        raise
+    finally:
+        del _vuelos[cache_key]
+
+async def get_productos_from_db(categoria: Optional[str] = None):
+    """Obtiene productos de la base de datos"""
+    async with db_pool.acquire() as conn:
+        with medir("db_consulta"):
+            if categoria:
+                rows = await conn.fetch(
+                    "SELECT id, nombre, categoria, precio, stock, marca FROM productos WHERE categoria = $1 ORDER BY nombre",
+                    categoria
+                )
+            else:
+                rows = await conn.fetch("SELECT id, nombre, categoria, precio, stock, marca FROM productos ORDER BY nombre")
+    return [dict(row) for row in rows]
+
+async def get_categorias_from_db():
+    """Obtiene las categorías distintas de la base de datos"""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT DISTINCT categoria FROM productos ORDER BY categoria")
+    return {"categorias": [row["categoria"] for row in rows]}
+
+async def get_producto_from_db(producto_id: int):
+    """Obtiene el detalle de un producto, 404 si no existe"""
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT id, nombre, categoria, precio, stock, marca, descripcion, imagen_url
+            FROM productos
+            WHERE id = $1
+            """,
+            producto_id
+        )
+
+    if not row:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Producto con ID {producto_id} no encontrado"
+        )
+    return dict(row)
+
+@app.get("/api/health")
+async def health():
+    return {"estado": "OK", "modo": "async"}
+
+@app.get("/api/pool/status")
+async def pool_status():
+    """Estadísticas del pool de asyncpg"""
+    if db_pool is None:
+        return {"status": "disconnected"}
+    idle = db_pool.get_idle_size()
+    size = db_pool.get_size()
+    return {
+        "min": db_pool.get_min_size(),
+        "max": db_pool.get_max_size(),
+        "en_uso": size - idle,
+        "idle": idle,
+    }
+
+@app.get("/api/productos", response_model=ListaProductos)
+async def listar_productos(
+    categoria: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    formato: str = Query("objetos", pattern="^(objetos|filas)$"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Lista todos los productos o filtra por categoría con cache Redis"""
+    if limite is not None or cursor is not None or fields is not None or formato != "objetos":
+        # Paginación, proyección y formato por filas se resuelven con la implementación síncrona (mismo cache y claves)
+        return await run_in_threadpool(listar_productos_sync, categoria, limite, cursor, fields, formato, if_none_match)
+    try:
+        cache_key = clave_listas('all' if not categoria else f'categoria:{categoria}', await generacion_listas_actual())
+        return respuesta_condicional(
+            cache_key, await obtener_con_cache(cache_key, lambda: get_productos_from_db(categoria)), if_none_match
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener productos: {str(e)}")
+
+# Exportación y búsqueda usan la implementación síncrona; se registran antes de /api/productos/{producto_id}
+app.get("/api/productos/export")(exportar_productos)
+app.get("/api/productos/search")(buscar_productos)
+app.get("/api/productos/filtrar")(filtrar_productos)
+app.get("/api/productos/batch")(obtener_productos_batch)
+
+@app.get("/api/categorias")
+async def listar_categorias(if_none_match: Optional[str] = Header(None)):
+    """Lista todas las categorías disponibles"""
+    try:
+        cache_key = "categorias:all"
+        return respuesta_condicional(
+            cache_key, await obtener_con_cache(cache_key, get_categorias_from_db), if_none_match, CACHE_HTTP_MAX_AGE_CATEGORIAS
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener categorías: {str(e)}")
+
+@app.get("/api/productos/{producto_id}", response_model=Producto)
+async def obtener_producto(producto_id: int, if_none_match: Optional[str] = Header(None)):
+    """Obtiene un producto específico por su ID"""
+    try:
+        cache_key = f"producto:{producto_id}"
+        return respuesta_condicional(
+            cache_key, await obtener_con_cache(cache_key, lambda: get_producto_from_db(producto_id)), if_none_match
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al obtener el producto: {str(e)}"
+        )
+
+# El resto de endpoints (registro de productos, administración de cache) se atienden con la app síncrona
+app.mount("/", app_sync)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
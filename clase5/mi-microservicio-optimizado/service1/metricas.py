@@ -0,0 +1,135 @@
+"""Métricas Prometheus del servicio de productos (GET /metrics)
+
+Latencia por ruta, tiempo por etapa (pool, consulta, Redis, serialización), eventos de cache por
+namespace y saturación del pool. El hit ratio por namespace se obtiene en Prometheus con:
+
+    sum by (namespace) (rate(cache_eventos_total{evento=~"l1_hit|hit|stale"}[5m]))
+      / sum by (namespace) (rate(cache_eventos_total{evento=~"l1_hit|hit|stale|miss"}[5m]))
+"""
+import os
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+LATENCIA_HTTP = Histogram(
+    "http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por ruta",
+    ["metodo", "ruta", "estado"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+LATENCIA_ETAPA = Histogram(
+    "etapa_duration_seconds",
+    "Tiempo de cada etapa de una petición",
+    ["etapa"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+EVENTOS_CACHE = Counter(
+    "cache_eventos",
+    "Eventos de cache por namespace de clave (l1_hit, hit, stale, miss, coalesced, refresh)",
+    ["namespace", "evento"],
+)
+
+# Hijos ya resueltos: observar no busca labels en cada llamada
+_ETAPAS = {
+    etapa: LATENCIA_ETAPA.labels(etapa)
+    for etapa in ("db_conexion", "db_consulta", "redis_get", "redis_set", "serializacion")
+}
+_CONSULTA = _ETAPAS["db_consulta"]
+
+
+@contextmanager
+def medir(etapa: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _ETAPAS[etapa].observe(time.perf_counter() - inicio)
+
+
+def contar_evento_cache(cache_key: str, evento: str):
+    EVENTOS_CACHE.labels(cache_key.split(":", 1)[0], evento).inc()
+
+
+class CursorMedido(psycopg2.extensions.cursor):
+    """Cursor que registra el tiempo de cada execute (se usa como cursor_factory de las conexiones)"""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _CONSULTA.observe(time.perf_counter() - inicio)
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mide cada petición con la plantilla de la ruta como label"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Con main_async la app síncrona está montada dentro: cada petición se mide una sola vez
+        if scope["type"] != "http" or scope.get("metricas"):
+            await self.app(scope, receive, send)
+            return
+        scope["metricas"] = True
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = scope.get("route")
+            LATENCIA_HTTP.labels(
+                scope["method"], ruta.path if ruta is not None else "sin_ruta", str(estado)
+            ).observe(time.perf_counter() - inicio)
+
+
+class ColectorPool:
+    """Lee las estadísticas del pool solo cuando Prometheus consulta /metrics"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def collect(self):
+        datos = self.stats()
+        conexiones = GaugeMetricFamily("db_pool_conexiones", "Conexiones del pool por estado", labels=["estado"])
+        for estado in ("en_uso", "idle", "max"):
+            conexiones.add_metric([estado], datos[estado])
+        yield conexiones
+        yield GaugeMetricFamily(
+            "db_pool_saturacion", "Fracción del pool en uso", value=datos["en_uso"] / datos["max"] if datos["max"] else 0
+        )
+        yield CounterMetricFamily("db_pool_esperas", "Checkouts que tuvieron que esperar", value=datos["esperas"])
+        yield CounterMetricFamily("db_pool_timeouts", "Checkouts que agotaron DB_POOL_TIMEOUT", value=datos["timeouts"])
+
+
+# Colectores que leen el estado del proceso al momento del scrape (no se agregan entre workers)
+REGISTRO_PROCESO = CollectorRegistry()
+
+
+def registrar_pool(stats):
+    REGISTRO_PROCESO.register(ColectorPool(stats))
+
+
+def respuesta_metricas():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Con varios workers (gunicorn.conf.py) se suman los archivos que escribe cada proceso, incluidos
+        # los workers ya reciclados; el pool informado es el del worker que atiende el scrape
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro) + generate_latest(REGISTRO_PROCESO), CONTENT_TYPE_LATEST
@@ -1,14 +1,40 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from contextlib import contextmanager
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from contextlib import asynccontextmanager, contextmanager
 import json
+import logging
+import orjson
+import base64
+import csv
+import hashlib
+import io
+import threading
+import time
+import uuid
 from decimal import Decimal
+import redis
 
-app = FastAPI(title="Tienda Hardware API - Carrito Compra")
+from metricas import MiddlewareMetricas, CursorMedido, CONEXIONES_ABIERTAS, medir, respuesta_metricas
+from registro import MiddlewareRequestId, configurar_logging, request_id
+
+configurar_logging("pedidos")
+log = logging.getLogger("pedidos")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """El cliente de Redis de cada worker se crea al arrancar, no al importar, y se cierra al drenar"""
+    conectar_redis()
+    yield
+    cerrar_redis()
+
+app = FastAPI(title="Tienda Hardware API - Carrito Compra", lifespan=lifespan)
 
 
 app.add_middleware(
@@ -18,6 +44,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MiddlewareMetricas)
+app.add_middleware(MiddlewareRequestId)
 
 # Configuración de la base de datos
 import os
@@ -31,13 +59,205 @@ DB_CONFIG = {
 }
 
 
+# Cliente de Redis del proceso (cache compartido con el servicio de productos): lo crea conectar_redis()
+# al iniciar cada worker, después del fork
+redis_client = None
 
 CACHE_TTL = 300
+CANAL_INVALIDACIONES = "cache:invalidaciones"
+# Generación de las listas de service1: va en sus claves, invalidarlas es un INCR (O(1))
+CACHE_GENERACION_LISTAS = "cache:gen:productos"
+
+# Estrategia de concurrencia del checkout:
+#   "atomico"    -> lectura sin bloqueo + UPDATE condicional (stock >= cantidad), sin sobreventa
+#   "for_update" -> bloquea las filas con SELECT ... ORDER BY id FOR UPDATE antes de validar
+#   "redis"      -> reserva el stock con un script Lua sobre contadores en Redis; Postgres solo recibe
+#                   las filas del pedido y el reconciliador aplica el stock vendido por lotes
+CHECKOUT_MODO_BLOQUEO = os.getenv("CHECKOUT_MODO_BLOQUEO", "atomico")
+CHECKOUT_REINTENTOS = int(os.getenv("CHECKOUT_REINTENTOS", "3"))
+
+# Reserva de stock en Redis (CHECKOUT_MODO_BLOQUEO=redis)
+CLAVE_STOCK_DELTA = "stock:delta"
+CLAVE_STOCK_PROCESANDO = "stock:delta:procesando"
+CLAVE_STOCK_LOTE = "stock:delta:lote"
+# Se incrementa cada vez que se toma o se cierra un lote: permite detectar un lote que pasó durante una carga
+CLAVE_STOCK_VERSION = "stock:delta:version"
+STOCK_RECONCILIAR_CADA = float(os.getenv("STOCK_RECONCILIAR_CADA", "1"))
+# Intentos de crear un contador mientras el reconciliador cambia de lote
+STOCK_CARGA_REINTENTOS = 5
+
+# KEYS: stock:delta, stock:{id}...  ARGV: cantidades..., ids...
+# Reserva todo el carrito o nada: -1 si falta algún contador, 0 si no alcanza el stock, 1 si se reservó
+LUA_RESERVAR_STOCK = """
+local n = #KEYS - 1
+local faltantes = {}
+for i = 1, n do
+    if redis.call('EXISTS', KEYS[i + 1]) == 0 then
+        table.insert(faltantes, i)
+    end
+end
+if #faltantes > 0 then
+    return {-1, faltantes}
+end
+for i = 1, n do
+    local disponible = tonumber(redis.call('GET', KEYS[i + 1]))
+    if disponible < tonumber(ARGV[i]) then
+        return {0, i, disponible}
+    end
+end
+for i = 1, n do
+    redis.call('DECRBY', KEYS[i + 1], ARGV[i])
+    redis.call('HINCRBY', KEYS[1], ARGV[n + i], -tonumber(ARGV[i]))
+end
+return {1}
+"""
+
+# Devuelve una reserva cuando el pedido no llega a confirmarse en Postgres. El delta se compensa
+# siempre: si el contador desapareció (borrado o desalojado) el -cantidad no debe llegar a productos
+LUA_LIBERAR_STOCK = """
+local n = #KEYS - 1
+for i = 1, n do
+    if redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        redis.call('INCRBY', KEYS[i + 1], ARGV[i])
+    end
+    redis.call('HINCRBY', KEYS[1], ARGV[n + i], ARGV[i])
+end
+return n
+"""
+
+# KEYS: stock:delta, stock:delta:procesando, stock:delta:version, stock:{id}...
+# ARGV: versión leída antes de consultar Postgres, 1 si el lote en curso ya estaba aplicado, stock en Postgres..., ids...
+# Crea los contadores que faltan sumando los deltas que el reconciliador todavía no aplicó. Devuelve 0 sin
+# crear nada si desde la lectura se tomó o cerró un lote: el stock leído ya no corresponde a los deltas
+LUA_INICIALIZAR_STOCK = """
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+    return 0
+end
+local n = #KEYS - 3
+for i = 1, n do
+    local pendiente = tonumber(redis.call('HGET', KEYS[1], ARGV[n + 2 + i]) or '0')
+    if ARGV[2] == '0' then
+        pendiente = pendiente + tonumber(redis.call('HGET', KEYS[2], ARGV[n + 2 + i]) or '0')
+    end
+    redis.call('SET', KEYS[i + 3], tonumber(ARGV[i + 2]) + pendiente, 'NX')
+end
+return 1
+"""
+
+# KEYS: stock:delta, stock:delta:procesando, stock:delta:lote, stock:delta:version  ARGV: id de lote nuevo
+# Retoma el lote pendiente o congela los deltas acumulados en un lote nuevo
+LUA_TOMAR_LOTE_STOCK = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('SET', KEYS[3], ARGV[1])
+    redis.call('INCR', KEYS[4])
+end
+return {redis.call('GET', KEYS[3]), redis.call('HGETALL', KEYS[2])}
+"""
+
+# Borra el lote solo si sigue siendo el mismo que se aplicó (otro reconciliador pudo tomar uno nuevo)
+LUA_CERRAR_LOTE_STOCK = """
+if redis.call('GET', KEYS[3]) == ARGV[1] then
+    redis.call('DEL', KEYS[2], KEYS[3])
+    redis.call('INCR', KEYS[4])
+    return 1
+end
+return 0
+"""
+
+# KEYS: pedidos:cola, pedido:pendiente:{id}, idempotencia:cola:{clave} (solo con Idempotency-Key)
+# ARGV: pedido_id, carrito, request_id, ttl del pendiente, valor de la clave, ttl de la clave
+# Toma la clave y agrega el pedido al stream en una sola operación: devuelve el valor previo de la clave
+# si ya existía, o nada si se encoló. Si el XADD falla no queda la clave apuntando a un pedido sin encolar
+LUA_ENCOLAR_PEDIDO = """
+if #KEYS == 3 and not redis.call('SET', KEYS[3], ARGV[5], 'NX', 'EX', ARGV[6]) then
+    return redis.call('GET', KEYS[3])
+end
+local resultado = redis.pcall('XADD', KEYS[1], '*', 'pedido_id', ARGV[1], 'carrito', ARGV[2], 'request_id', ARGV[3])
+if type(resultado) == 'table' and resultado.err then
+    if #KEYS == 3 then
+        redis.call('DEL', KEYS[3])
+    end
+    return resultado
+end
+redis.call('SET', KEYS[2], 1, 'EX', ARGV[4])
+return false
+"""
+
+# Borra la clave de idempotencia de la cola solo si sigue apuntando al pedido que no se pudo encolar
+LUA_SOLTAR_CLAVE_COLA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+reservar_stock_script = None
+liberar_stock_script = None
+inicializar_stock_script = None
+tomar_lote_stock = None
+cerrar_lote_stock = None
+encolar_pedido_script = None
+soltar_clave_cola = None
+
+def conectar_redis():
+    """Crea el cliente de Redis y registra los scripts Lua (una vez por worker, en el arranque)"""
+    global redis_client, reservar_stock_script, liberar_stock_script
+    global inicializar_stock_script, tomar_lote_stock, cerrar_lote_stock, encolar_pedido_script, soltar_clave_cola
+    try:
+        redis_client = redis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            db=0,
+            decode_responses=True,
+            socket_connect_timeout=5,
+            socket_timeout=5
+        )
+        # Verificar conexión
+        redis_client.ping()
+        log.info("Conectado a Redis")
+    except redis.RedisError as e:
+        log.warning("No se pudo conectar a Redis: %s", e)
+        redis_client = None
+    registrar = redis_client.register_script if redis_client else lambda script: None
+    reservar_stock_script = registrar(LUA_RESERVAR_STOCK)
+    liberar_stock_script = registrar(LUA_LIBERAR_STOCK)
+    inicializar_stock_script = registrar(LUA_INICIALIZAR_STOCK)
+    tomar_lote_stock = registrar(LUA_TOMAR_LOTE_STOCK)
+    cerrar_lote_stock = registrar(LUA_CERRAR_LOTE_STOCK)
+    encolar_pedido_script = registrar(LUA_ENCOLAR_PEDIDO)
+    soltar_clave_cola = registrar(LUA_SOLTAR_CLAVE_COLA)
+
+def cerrar_redis():
+    """Cierra el cliente de Redis del worker cuando termina de drenar"""
+    global redis_client
+    if redis_client is not None:
+        redis_client.close()
+        redis_client = None
+
+# Idempotency-Key: tiempo que se conserva la respuesta y cada cuánto se purgan las claves vencidas
+IDEMPOTENCIA_TTL = int(os.getenv("IDEMPOTENCIA_TTL", "86400"))
+IDEMPOTENCIA_LIMPIEZA = float(os.getenv("IDEMPOTENCIA_LIMPIEZA", "300"))
+IDEMPOTENCIA_LOTE = 1000
+
+# Checkout en cola: la API valida y encola en un Redis Stream; worker_pedidos.py confirma por lotes
+CHECKOUT_COLA = os.getenv("CHECKOUT_COLA", "0") == "1"
+STREAM_PEDIDOS = "pedidos:cola"
+GRUPO_PEDIDOS = "checkout"
+PEDIDO_PENDIENTE_TTL = int(os.getenv("PEDIDO_PENDIENTE_TTL", "3600"))
+# Ids de pedido reservados de la secuencia por cada consulta
+CHECKOUT_IDS_LOTE = int(os.getenv("CHECKOUT_IDS_LOTE", "50"))
 
 class ItemCarrito(BaseModel):
     producto_id: int
     cantidad: int
 
+# Largo de pedidos.cliente_nombre y pedidos.cliente_email (VARCHAR(255))
+CLIENTE_MAX_LARGO = 255
+
 class CarritoCreate(BaseModel):
     cliente_nombre: str
     cliente_email: str
@@ -50,13 +270,43 @@ class PedidoResponse(BaseModel):
     total: Optional[float] = None
 
 
+# Conversión directa de DECIMAL(10,2) al decodificar la fila, sin objetos Decimal intermedios
+DECIMAL_A_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "DECIMAL_A_FLOAT",
+    lambda valor, cur: float(valor) if valor is not None else None
+)
+
+def _a_centavos(valor, cur):
+    # Postgres entrega los DECIMAL(10,2) como texto "123.45"; se lee como entero en centavos
+    if valor is None:
+        return None
+    entero, _, fraccion = valor.partition(".")
+    return int(entero + fraccion.ljust(2, "0")[:2])
+
+DECIMAL_A_CENTAVOS = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, "DECIMAL_A_CENTAVOS", _a_centavos
+)
+
+def centavos_a_decimal(centavos: int) -> Decimal:
+    return Decimal(centavos).scaleb(-2)
+
+def respuesta_json(datos) -> Response:
+    """Serializa con orjson sin pasar por la validación del response_model"""
+    with medir("serializacion"):
+        cuerpo = orjson.dumps(datos, default=_json_default)
+    return Response(content=cuerpo, media_type="application/json")
+
 @contextmanager
 def get_db_connection():
-    conn = psycopg2.connect(**DB_CONFIG)
+    with medir("db_conexion"):
+        conn = psycopg2.connect(cursor_factory=CursorMedido, **DB_CONFIG)
+    CONEXIONES_ABIERTAS.inc()
     try:
         yield conn
     finally:
         conn.close()
+        CONEXIONES_ABIERTAS.dec()
 
 @app.get("/")
 def root():
@@ -66,10 +316,526 @@ def root():
 def root():
     return {"estado": "OK"}    
 
+@app.get("/metrics")
+def metricas():
+    """Métricas en formato de exposición de Prometheus"""
+    cuerpo, media_type = respuesta_metricas()
+    return Response(content=cuerpo, media_type=media_type)
+
+
+def invalidar_cache_productos(producto_ids: List[int]):
+    """Invalida las claves de cache del servicio de productos afectadas por un cambio de stock"""
+    if not redis_client:
+        return
+    
+    # Mismos nombres de clave, generación y canal de invalidaciones que usa service1
+    claves = [f"producto:{producto_id}" for producto_id in producto_ids]
+    try:
+        with medir("redis"):
+            generacion = redis_client.incr(CACHE_GENERACION_LISTAS)
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.delete(*claves)
+            # Avisar a las réplicas de service1 la generación nueva y que descarten su cache L1
+            pipe.publish(CANAL_INVALIDACIONES, json.dumps({"claves": claves + ["productos:*"], "generacion": generacion}))
+            pipe.execute()
+    except redis.RedisError as e:
+        log.error("Error al invalidar caché: %s", e)
+
+def borrar_contadores_stock(producto_ids: List[int]):
+    """El stock se descontó directo en la base: el próximo checkout con reserva recrea los contadores
+
+    Sin esto los contadores de Redis quedan por encima de productos.stock y se sobrevende; al recrearlos
+    cargar_stock_redis ya suma los deltas pendientes.
+    """
+    if not redis_client or not producto_ids:
+        return
+    try:
+        with medir("redis"):
+            redis_client.unlink(*[f"stock:{producto_id}" for producto_id in producto_ids])
+    except redis.RedisError as e:
+        log.error("Error al borrar contadores de stock: %s", e)
+
+def cargar_stock_redis(producto_ids: List[int]):
+    """Crea en Redis los contadores de stock que faltan a partir de productos.stock
+
+    productos.stock y los deltas pendientes tienen que corresponder al mismo punto del reconciliador:
+    si un lote se toma o se cierra entre la consulta y la carga, se vuelve a leer.
+    """
+    for _ in range(STOCK_CARGA_REINTENTOS):
+        version, lote = redis_client.mget(CLAVE_STOCK_VERSION, CLAVE_STOCK_LOTE)
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                # Si el lote en curso ya se confirmó, productos.stock ya incluye sus deltas
+                cur.execute(
+                    """
+                    SELECT id, stock, EXISTS (SELECT 1 FROM stock_reconciliaciones WHERE lote = %s)
+                    FROM productos WHERE id = ANY(%s)
+                    """,
+                    (lote, producto_ids)
+                )
+                filas = cur.fetchall()
+        if not filas:
+            return
+        if inicializar_stock_script(
+            keys=[CLAVE_STOCK_DELTA, CLAVE_STOCK_PROCESANDO, CLAVE_STOCK_VERSION] + [f"stock:{pid}" for pid, _, _ in filas],
+            args=[version or "0", int(filas[0][2])] + [stock for _, stock, _ in filas] + [pid for pid, _, _ in filas]
+        ):
+            return
+    raise HTTPException(status_code=503, detail="El stock se está reconciliando, intente nuevamente")
+
+def reservar_stock(cantidades: dict):
+    """Descuenta atómicamente en Redis el stock de todo el carrito o lanza 404/400 sin reservar nada"""
+    producto_ids = sorted(cantidades)
+    claves = [CLAVE_STOCK_DELTA] + [f"stock:{pid}" for pid in producto_ids]
+    args = [cantidades[pid] for pid in producto_ids] + producto_ids
+    
+    with medir("redis"):
+        resultado = reservar_stock_script(keys=claves, args=args)
+    if resultado[0] == -1:
+        cargar_stock_redis([producto_ids[i - 1] for i in resultado[1]])
+        resultado = reservar_stock_script(keys=claves, args=args)
+    
+    if resultado[0] == -1:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Producto con ID {producto_ids[resultado[1][0] - 1]} no encontrado"
+        )
+    if resultado[0] == 0:
+        producto_id, disponible = producto_ids[resultado[1] - 1], resultado[2]
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT nombre FROM productos WHERE id = %s", (producto_id,))
+                nombre = cur.fetchone()[0]
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Stock insuficiente para {nombre}. Disponible: {disponible}"
+        )
+
+def liberar_stock(cantidades: dict):
+    producto_ids = sorted(cantidades)
+    try:
+        liberar_stock_script(
+            keys=[CLAVE_STOCK_DELTA] + [f"stock:{pid}" for pid in producto_ids],
+            args=[cantidades[pid] for pid in producto_ids] + producto_ids
+        )
+    except redis.RedisError as e:
+        log.error("No se pudo liberar la reserva de stock %s: %s", cantidades, e)
+
+def reconciliar_stock() -> int:
+    """Aplica en productos el stock vendido acumulado en Redis, una vez por lote"""
+    resultado = tomar_lote_stock(
+        keys=[CLAVE_STOCK_DELTA, CLAVE_STOCK_PROCESANDO, CLAVE_STOCK_LOTE, CLAVE_STOCK_VERSION],
+        args=[uuid.uuid4().hex]
+    )
+    if not resultado:
+        return 0
+    lote, campos = resultado
+    deltas = {int(campos[i]): int(campos[i + 1]) for i in range(0, len(campos), 2)}
+    producto_ids = sorted(pid for pid, delta in deltas.items() if delta)
+    
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            # El registro del lote en la misma transacción evita aplicarlo dos veces si se reintenta
+            cur.execute(
+                "INSERT INTO stock_reconciliaciones (lote) VALUES (%s) ON CONFLICT (lote) DO NOTHING",
+                (lote,)
+            )
+            if cur.rowcount and producto_ids:
+                cur.execute(
+                    """
+                    UPDATE productos p
+                    SET stock = p.stock + d.delta
+                    FROM unnest(%s::int[], %s::int[]) AS d(producto_id, delta)
+                    WHERE p.id = d.producto_id
+                    """,
+                    (producto_ids, [deltas[pid] for pid in producto_ids])
+                )
+        conn.commit()
+    
+    cerrar_lote_stock(
+        keys=[CLAVE_STOCK_DELTA, CLAVE_STOCK_PROCESANDO, CLAVE_STOCK_LOTE, CLAVE_STOCK_VERSION], args=[lote]
+    )
+    if producto_ids:
+        invalidar_cache_productos(producto_ids)
+    return len(producto_ids)
+
+def ejecutar_reconciliador():
+    vueltas = 0
+    while True:
+        time.sleep(STOCK_RECONCILIAR_CADA)
+        try:
+            reconciliar_stock()
+            vueltas += 1
+            if vueltas % 3600 == 0:
+                with get_db_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("DELETE FROM stock_reconciliaciones WHERE aplicado_en < NOW() - INTERVAL '1 day'")
+                    conn.commit()
+        except (redis.RedisError, psycopg2.Error) as e:
+            log.error("Error al reconciliar stock: %s", e)
+
+_reconciliador_iniciado = False
+_reconciliador_lock = threading.Lock()
+
+def asegurar_reconciliador():
+    global _reconciliador_iniciado
+    if _reconciliador_iniciado:
+        return
+    with _reconciliador_lock:
+        if not _reconciliador_iniciado:
+            threading.Thread(target=ejecutar_reconciliador, name="stock-reconciliador", daemon=True).start()
+            _reconciliador_iniciado = True
+
+def registrar_pedido(cur, carrito: CarritoCreate, cantidades: dict, pedido_id: Optional[int] = None,
+                     estado: str = "pendiente", reservado: bool = False):
+    """Valida stock, lo descuenta e inserta el pedido con sus items dentro de la transacción actual
+
+    Con reservado=True el stock ya se descontó en Redis y solo se insertan las filas del pedido.
+    Si algo falla se lanza HTTPException y el llamador deshace la transacción (o el savepoint).
+    """
+    # Precios en centavos enteros: el total se calcula con aritmética entera exacta
+    psycopg2.extensions.register_type(DECIMAL_A_CENTAVOS, cur)
+    # Orden determinista por producto_id para que pedidos concurrentes bloqueen las filas en el mismo orden
+    producto_ids = sorted(cantidades)
+    
+    # Obtener todos los productos del carrito en una sola consulta
+    if CHECKOUT_MODO_BLOQUEO == "for_update":
+        cur.execute(
+            "SELECT id, nombre, precio, stock FROM productos WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+            (producto_ids,)
+        )
+    else:
+        cur.execute(
+            "SELECT id, nombre, precio, stock FROM productos WHERE id = ANY(%s)",
+            (producto_ids,)
+        )
+    productos = {
+        producto_id: {"nombre": nombre, "precio": precio, "stock": stock}
+        for producto_id, nombre, precio, stock in cur.fetchall()
+    }
+    
+    # Validar productos y stock
+    for producto_id, cantidad in cantidades.items():
+        producto = productos.get(producto_id)
+        
+        if not producto:
+            raise HTTPException(
+                status_code=404, 
+                detail=f"Producto con ID {producto_id} no encontrado"
+            )
+        
+        if not reservado and producto['stock'] < cantidad:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Stock insuficiente para {producto['nombre']}. Disponible: {producto['stock']}"
+            )
+    
+    # Calcular total
+    total_centavos = 0
+    items_detalle = []
+    # Copia de los items con nombre y precio del momento de la compra, para leer el pedido sin JOIN
+    items_resumen = []
+    for item in carrito.items:
+        precio = productos[item.producto_id]['precio']
+        subtotal = precio * item.cantidad
+        total_centavos += subtotal
+        
+        items_detalle.append((item.producto_id, item.cantidad, centavos_a_decimal(precio), centavos_a_decimal(subtotal)))
+        items_resumen.append({
+            "producto_id": item.producto_id,
+            "producto_nombre": productos[item.producto_id]['nombre'],
+            "cantidad": item.cantidad,
+            "precio_unitario": precio / 100,
+            "subtotal": subtotal / 100,
+        })
+    total_pedido = centavos_a_decimal(total_centavos)
+    
+    if not reservado:
+        # Descontar el stock de todos los productos con un único UPDATE condicional
+        cur.execute(
+            """
+            UPDATE productos p
+            SET stock = p.stock - c.cantidad
+            FROM unnest(%s::int[], %s::int[]) AS c(producto_id, cantidad)
+            WHERE p.id = c.producto_id AND p.stock >= c.cantidad
+            RETURNING p.id
+            """,
+            (producto_ids, [cantidades[pid] for pid in producto_ids])
+        )
+        actualizados = {row[0] for row in cur.fetchall()}
+    
+        if len(actualizados) != len(producto_ids):
+            # Otro pedido consumió el stock entre la lectura y el UPDATE
+            producto_id = next(pid for pid in cantidades if pid not in actualizados)
+            cur.execute("SELECT nombre, stock FROM productos WHERE id = %s", (producto_id,))
+            producto = cur.fetchone()
+            if not producto:
+                raise HTTPException(
+                    status_code=404, 
+                    detail=f"Producto con ID {producto_id} no encontrado"
+                )
+            nombre, stock = producto
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Stock insuficiente para {nombre}. Disponible: {stock}"
+            )
+    
+    # Crear el pedido (con el id ya reservado si viene de la cola)
+    cur.execute(
+        """
+        INSERT INTO pedidos (id, cliente_nombre, cliente_email, total, estado, items_resumen, fecha)
+        VALUES (COALESCE(%s, nextval('pedidos_id_seq')), %s, %s, %s, %s, %s, NOW())
+        RETURNING id
+        """,
+        (
+            pedido_id,
+            carrito.cliente_nombre.strip(),
+            carrito.cliente_email.strip(),
+            total_pedido,
+            estado,
+            orjson.dumps(items_resumen).decode()
+        )
+    )
+    
+    pedido_id = cur.fetchone()[0]
+    
+    # Insertar todos los items del pedido en una sola sentencia
+    execute_values(
+        cur,
+        """
+        INSERT INTO pedido_items (pedido_id, producto_id, cantidad, precio_unitario, subtotal)
+        VALUES %s
+        """,
+        [(pedido_id,) + item_det for item_det in items_detalle],
+        page_size=len(items_detalle)
+    )
+    
+    return pedido_id, total_pedido
+
+def huella_peticion(carrito: CarritoCreate) -> str:
+    """Hash del cuerpo de la petición para detectar una misma clave reutilizada con otro carrito"""
+    return hashlib.sha256(carrito.model_dump_json().encode()).hexdigest()
+
+def reservar_clave_idempotencia(cur, clave: str, huella: str):
+    """Registra la clave dentro de la transacción del pedido; devuelve (hash, respuesta) si ya existía
+
+    Si otra petición con la misma clave está en curso, el INSERT espera en el índice único hasta
+    que esa transacción confirme (y entonces se devuelve su respuesta) o se deshaga (y se continúa).
+    """
+    cur.execute(
+        """
+        INSERT INTO pedidos_idempotencia (clave, hash, expira_en)
+        VALUES (%s, %s, NOW() + make_interval(secs => %s))
+        ON CONFLICT (clave) DO UPDATE
+            SET hash = EXCLUDED.hash, pedido_id = NULL, respuesta = NULL, expira_en = EXCLUDED.expira_en
+            WHERE pedidos_idempotencia.expira_en < NOW()
+        """,
+        (clave, huella, IDEMPOTENCIA_TTL)
+    )
+    if cur.rowcount:
+        return None
+    cur.execute("SELECT hash, respuesta FROM pedidos_idempotencia WHERE clave = %s", (clave,))
+    return cur.fetchone()
+
+def respuesta_repetida(previa, huella: str) -> JSONResponse:
+    """Devuelve la respuesta guardada para la clave sin volver a tocar productos"""
+    hash_previo, respuesta = previa
+    if hash_previo != huella:
+        raise HTTPException(
+            status_code=422,
+            detail="La Idempotency-Key ya se usó con un carrito distinto"
+        )
+    if respuesta is None:
+        raise HTTPException(status_code=409, detail="El pedido con esta Idempotency-Key sigue en proceso")
+    log.info("Pedido repetido con Idempotency-Key", extra={"campos": {"pedido_id": respuesta["pedido_id"]}})
+    return JSONResponse(status_code=201, content=respuesta, headers={"Idempotent-Replayed": "true"})
+
+def limpiar_claves_idempotencia():
+    """Purga por lotes las claves vencidas para que la tabla no crezca sin límite"""
+    while True:
+        time.sleep(IDEMPOTENCIA_LIMPIEZA)
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    while True:
+                        cur.execute(
+                            """
+                            DELETE FROM pedidos_idempotencia
+                            WHERE clave IN (
+                                SELECT clave FROM pedidos_idempotencia
+                                WHERE expira_en < NOW()
+                                LIMIT %s
+                            )
+                            """,
+                            (IDEMPOTENCIA_LOTE,)
+                        )
+                        conn.commit()
+                        if cur.rowcount < IDEMPOTENCIA_LOTE:
+                            break
+        except psycopg2.Error as e:
+            log.error("Error al purgar claves de idempotencia: %s", e)
+
+_limpieza_iniciada = False
+_limpieza_lock = threading.Lock()
+
+def asegurar_limpieza_idempotencia():
+    """Arranca el hilo de purga la primera vez que llega una Idempotency-Key (después del fork)"""
+    global _limpieza_iniciada
+    if _limpieza_iniciada:
+        return
+    with _limpieza_lock:
+        if not _limpieza_iniciada:
+            threading.Thread(target=limpiar_claves_idempotencia, name="idempotencia-limpieza", daemon=True).start()
+            _limpieza_iniciada = True
+
+class ReservaIds:
+    """Reserva ids de pedidos_id_seq por bloques para encolar sin una consulta por pedido"""
+
+    def __init__(self, tamano: int):
+        self.tamano = tamano
+        self._ids = []
+        self._lock = threading.Lock()
+
+    def siguiente(self) -> int:
+        with self._lock:
+            if not self._ids:
+                with get_db_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT nextval('pedidos_id_seq') FROM generate_series(1, %s)", (self.tamano,))
+                        self._ids = [fila[0] for fila in reversed(cur.fetchall())]
+            return self._ids.pop()
+
+reserva_ids = ReservaIds(CHECKOUT_IDS_LOTE)
+
+def buscar_clave_idempotencia(clave: str):
+    """(hash, respuesta) de una clave vigente registrada por el checkout en línea, o None"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT hash, respuesta FROM pedidos_idempotencia WHERE clave = %s AND expira_en >= NOW()",
+                (clave,)
+            )
+            return cur.fetchone()
+
+def encolar_pedido(carrito: CarritoCreate, idempotency_key: Optional[str], huella: Optional[str]) -> JSONResponse:
+    """Reserva el id, marca el pedido como pendiente y lo agrega al stream; responde 202 sin tocar productos"""
+    if idempotency_key:
+        # La clave pudo atenderse en línea (p. ej. mientras Redis no respondía): se devuelve ese pedido
+        previa = buscar_clave_idempotencia(idempotency_key)
+        if previa is not None:
+            return respuesta_repetida(previa, huella)
+    
+    pedido_id = reserva_ids.siguiente()
+    claves = [STREAM_PEDIDOS, f"pedido:pendiente:{pedido_id}"]
+    valor_clave = json.dumps({"hash": huella, "pedido_id": pedido_id})
+    if idempotency_key:
+        claves.append(f"idempotencia:cola:{idempotency_key}")
+    try:
+        with medir("redis"):
+            # El request_id viaja con el pedido para correlacionar los logs del worker con la petición original
+            previa = encolar_pedido_script(
+                keys=claves,
+                args=[pedido_id, carrito.model_dump_json(), request_id.get() or "", PEDIDO_PENDIENTE_TTL,
+                      valor_clave, IDEMPOTENCIA_TTL]
+            )
+    except redis.RedisError:
+        if idempotency_key:
+            # Si el script llegó a tomar la clave pero no hubo respuesta, un reintento no debe recibir
+            # un 202 de un pedido que quizá no se encoló
+            try:
+                soltar_clave_cola(keys=[claves[2]], args=[valor_clave])
+            except redis.RedisError:
+                pass
+        raise
+    if previa is not None:
+        previa = json.loads(previa)
+        if previa["hash"] != huella:
+            raise HTTPException(status_code=422, detail="La Idempotency-Key ya se usó con un carrito distinto")
+        return respuesta_encolado(previa["pedido_id"], repetido=True)
+    log.info("Pedido encolado", extra={"campos": {"pedido_id": pedido_id}})
+    return respuesta_encolado(pedido_id)
+
+def respuesta_encolado(pedido_id: int, repetido: bool = False) -> JSONResponse:
+    headers = {"Location": f"/cart/pedidos/{pedido_id}"}
+    if repetido:
+        headers["Idempotent-Replayed"] = "true"
+    return JSONResponse(
+        status_code=202,
+        content=PedidoResponse(success=True, message="Pedido recibido, en proceso", pedido_id=pedido_id).model_dump(),
+        headers=headers
+    )
+
+def confirmar_pedido(carrito: CarritoCreate, cantidades: dict, idempotency_key: Optional[str],
+                     huella: Optional[str], reservado: bool):
+    """Transacción del pedido con reintentos por contención; devuelve (respuesta, creado)
+
+    Con reservado=True el stock se reserva en Redis después de tomar la Idempotency-Key: una repetición
+    recibe la respuesta guardada (o espera en el índice único a la petición en curso) sin tocar los
+    contadores. Si el pedido no se confirma, la reserva se devuelve.
+    """
+    reserva_tomada = False
+    with get_db_connection() as conn:
+        try:
+            for intento in range(1, CHECKOUT_REINTENTOS + 1):
+                try:
+                    with conn.cursor() as cur:
+                        if idempotency_key:
+                            previa = reservar_clave_idempotencia(cur, idempotency_key, huella)
+                            if previa is not None:
+                                conn.rollback()
+                                return respuesta_repetida(previa, huella), False
+                        
+                        if reservado and not reserva_tomada:
+                            reservar_stock(cantidades)
+                            reserva_tomada = True
+                        
+                        pedido_id, total_pedido = registrar_pedido(cur, carrito, cantidades, reservado=reservado)
+                        respuesta = PedidoResponse(
+                            success=True,
+                            message="Pedido creado exitosamente",
+                            pedido_id=pedido_id,
+                            total=float(total_pedido)
+                        )
+                        
+                        if idempotency_key:
+                            # La respuesta se confirma junto con el pedido: no hay pedido sin clave ni clave sin pedido
+                            cur.execute(
+                                "UPDATE pedidos_idempotencia SET pedido_id = %s, respuesta = %s WHERE clave = %s",
+                                (pedido_id, respuesta.model_dump_json(), idempotency_key)
+                            )
+                    conn.commit()
+                    break
+                except (psycopg2.errors.DeadlockDetected, psycopg2.errors.SerializationFailure) as e:
+                    # Postgres abortó la transacción por contención, se reintenta desde el inicio
+                    conn.rollback()
+                    if intento == CHECKOUT_REINTENTOS:
+                        raise
+                    log.warning("Reintentando pedido (%d/%d): %s", intento, CHECKOUT_REINTENTOS, e)
+        except BaseException:
+            if reserva_tomada:
+                liberar_stock(cantidades)
+            raise
+        
+        log.info("Pedido creado", extra={"campos": {"pedido_id": pedido_id, "total": float(total_pedido)}})
+        
+        # El stock cambió: invalidar el detalle y las listas cacheadas por el servicio de productos.
+        # Con reserva en Redis productos.stock cambia al reconciliar y es el reconciliador quien invalida.
+        if not reservado:
+            borrar_contadores_stock(list(cantidades))
+            invalidar_cache_productos(list(cantidades))
+        
+        return respuesta, True
 
 @app.post("/cart/pedidos", response_model=PedidoResponse, status_code=201)
-def crear_pedido(carrito: CarritoCreate):
-    """Crea un nuevo pedido con los items del carrito"""
+def crear_pedido(
+    carrito: CarritoCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=255)
+):
+    """Crea un nuevo pedido con los items del carrito
+
+    Con el header Idempotency-Key, los reintentos del mismo carrito devuelven el pedido ya creado.
+    Con CHECKOUT_COLA=1 el pedido se encola y se responde 202; el estado se consulta en /cart/pedidos/{id}.
+    """
     try:
         # Validaciones básicas
         if not carrito.items:
@@ -81,133 +847,166 @@ def crear_pedido(carrito: CarritoCreate):
         if not carrito.cliente_email.strip():
             raise HTTPException(status_code=400, detail="El email del cliente es requerido")
         
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Iniciar transacción
-                total_pedido = Decimal('0.00')
-                items_detalle = []
-                
-                # Validar productos y calcular total
-                for item in carrito.items:
-                    if item.cantidad <= 0:
-                        raise HTTPException(
-                            status_code=400, 
-                            detail=f"La cantidad debe ser mayor a 0"
-                        )
-                    
-                    # Obtener información del producto
-                    cur.execute(
-                        "SELECT id, nombre, precio, stock FROM productos WHERE id = %s",
-                        (item.producto_id,)
-                    )
-                    producto = cur.fetchone()
-                    
-                    if not producto:
-                        raise HTTPException(
-                            status_code=404, 
-                            detail=f"Producto con ID {item.producto_id} no encontrado"
-                        )
-                    
-                    if producto['stock'] < item.cantidad:
-                        raise HTTPException(
-                            status_code=400, 
-                            detail=f"Stock insuficiente para {producto['nombre']}. Disponible: {producto['stock']}"
-                        )
-                    
-                    # Convertir precio a Decimal si no lo es
-                    precio = Decimal(str(producto['precio']))
-                    subtotal = precio * item.cantidad
-                    total_pedido += subtotal
-                    
-                    items_detalle.append({
-                        'producto_id': item.producto_id,
-                        'nombre': producto['nombre'],
-                        'cantidad': item.cantidad,
-                        'precio_unitario': precio,
-                        'subtotal': subtotal
-                    })
-                
-                # Crear el pedido
-                cur.execute(
-                    """
-                    INSERT INTO pedidos (cliente_nombre, cliente_email, total, estado, fecha)
-                    VALUES (%s, %s, %s, %s, NOW())
-                    RETURNING id
-                    """,
-                    (
-                        carrito.cliente_nombre.strip(),
-                        carrito.cliente_email.strip(),
-                        total_pedido,
-                        'pendiente'
-                    )
-                )
-                
-                pedido_id = cur.fetchone()['id']
-                
-                # Insertar los items del pedido y actualizar stock
-                for item_det in items_detalle:
-                    # Insertar item
-                    cur.execute(
-                        """
-                        INSERT INTO pedido_items (pedido_id, producto_id, cantidad, precio_unitario, subtotal)
-                        VALUES (%s, %s, %s, %s, %s)
-                        """,
-                        (
-                            pedido_id,
-                            item_det['producto_id'],
-                            item_det['cantidad'],
-                            item_det['precio_unitario'],
-                            item_det['subtotal']
-                        )
-                    )
-                    
-                    # Actualizar stock
-                    cur.execute(
-                        """
-                        UPDATE productos 
-                        SET stock = stock - %s 
-                        WHERE id = %s
-                        """,
-                        (item_det['cantidad'], item_det['producto_id'])
-                    )
-                
-                conn.commit()
-                
-                print(f"✓ Pedido creado con ID: {pedido_id}, Total: Bs.{float(total_pedido):.2f}")
-                
-                
-                return PedidoResponse(
-                    success=True,
-                    message="Pedido creado exitosamente",
-                    pedido_id=pedido_id,
-                    total=float(total_pedido)
+        # Mismo largo que las columnas de pedidos: en la cola el error aparecería después del 202
+        if len(carrito.cliente_nombre.strip()) > CLIENTE_MAX_LARGO:
+            raise HTTPException(status_code=400, detail=f"El nombre del cliente no puede superar {CLIENTE_MAX_LARGO} caracteres")
+        
+        if len(carrito.cliente_email.strip()) > CLIENTE_MAX_LARGO:
+            raise HTTPException(status_code=400, detail=f"El email del cliente no puede superar {CLIENTE_MAX_LARGO} caracteres")
+        
+        for item in carrito.items:
+            if item.cantidad <= 0:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"La cantidad debe ser mayor a 0"
                 )
+        
+        # Agrupar cantidades por producto (el carrito puede repetir un producto)
+        cantidades = {}
+        for item in carrito.items:
+            cantidades[item.producto_id] = cantidades.get(item.producto_id, 0) + item.cantidad
+        
+        huella = huella_peticion(carrito) if idempotency_key else None
+        
+        if CHECKOUT_COLA and redis_client:
+            try:
+                return encolar_pedido(carrito, idempotency_key, huella)
+            except redis.RedisError as e:
+                log.warning("No se pudo encolar el pedido, se procesa en línea: %s", e)
+        
+        if idempotency_key:
+            asegurar_limpieza_idempotencia()
+        
+        reservado = CHECKOUT_MODO_BLOQUEO == "redis"
+        if reservado:
+            # Descontar directo en la base dejaría desactualizados los contadores que usan las otras réplicas
+            if redis_client is None:
+                raise HTTPException(status_code=503, detail="Redis no está disponible para reservar stock")
+            asegurar_reconciliador()
+        
+        respuesta, _ = confirmar_pedido(carrito, cantidades, idempotency_key, huella, reservado)
+        return respuesta
                 
     except HTTPException:
         raise
     except psycopg2.Error as e:
-        print(f"Error de base de datos: {e}")
+        log.error("Error de base de datos: %s", e)
         raise HTTPException(
             status_code=500, 
             detail=f"Error al crear el pedido: {str(e)}"
         )
     except Exception as e:
-        print(f"Error inesperado: {e}")
+        log.exception("Error inesperado: %s", e)
         raise HTTPException(
             status_code=500, 
             detail=f"Error inesperado al crear el pedido: {str(e)}"
         )
 
+# Filas por lote al exportar con cursor del lado del servidor
+EXPORT_LOTE = int(os.getenv("EXPORT_LOTE", "2000"))
+
+def _json_default(valor):
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+def exportar_filas(sql: str, nombre_cursor: str, formato: str):
+    """Genera NDJSON o CSV por lotes desde un cursor con nombre (server-side), con memoria constante"""
+    with get_db_connection() as conn:
+        with conn.cursor(name=nombre_cursor) as cur:
+            cur.itersize = EXPORT_LOTE
+            cur.execute(sql)
+            columnas = None
+            while True:
+                filas = cur.fetchmany(EXPORT_LOTE)
+                if columnas is None:
+                    columnas = [col.name for col in cur.description]
+                    if formato == "csv":
+                        buffer = io.StringIO()
+                        csv.writer(buffer).writerow(columnas)
+                        yield buffer.getvalue().encode()
+                if not filas:
+                    break
+                if formato == "csv":
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(filas)
+                    yield buffer.getvalue().encode()
+                else:
+                    yield b"".join(orjson.dumps(dict(zip(columnas, fila)), default=_json_default) + b"\n" for fila in filas)
+
+@app.get("/cart/pedidos/export")
+def exportar_pedidos(
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    items: bool = False
+):
+    """Exporta el historial de pedidos (o sus items con items=true) en streaming, sin cargarlo en memoria"""
+    if items:
+        nombre = "pedido_items"
+        sql = """
+            SELECT pi.pedido_id, pi.producto_id, pi.cantidad, pi.precio_unitario, pi.subtotal, p.fecha
+            FROM pedido_items pi
+            JOIN pedidos p ON p.id = pi.pedido_id
+            ORDER BY pi.pedido_id, pi.id
+        """
+    else:
+        nombre = "pedidos"
+        sql = """
+            SELECT id, cliente_nombre, cliente_email, total, estado, fecha
+            FROM pedidos
+            ORDER BY id
+        """
+    return StreamingResponse(
+        exportar_filas(sql, f"export_{nombre}", formato),
+        media_type="text/csv" if formato == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{nombre}.{formato}"'}
+    )
+
+def pedido_pendiente(pedido_id: int) -> bool:
+    if not redis_client:
+        return False
+    try:
+        return bool(redis_client.exists(f"pedido:pendiente:{pedido_id}"))
+    except redis.RedisError:
+        return False
+
+def materializar_items(cur, pedido_id: int) -> str:
+    """Arma el resumen de items de un pedido anterior a items_resumen y lo guarda para las próximas lecturas"""
+    cur.execute(
+        """
+        SELECT COALESCE(jsonb_agg(jsonb_build_object(
+            'producto_id', pi.producto_id,
+            'producto_nombre', p.nombre,
+            'cantidad', pi.cantidad,
+            'precio_unitario', pi.precio_unitario,
+            'subtotal', pi.subtotal
+        ) ORDER BY pi.id), '[]'::jsonb)::text
+        FROM pedido_items pi
+        JOIN productos p ON pi.producto_id = p.id
+        WHERE pi.pedido_id = %s
+        """,
+        (pedido_id,)
+    )
+    items = cur.fetchone()[0]
+    cur.execute(
+        "UPDATE pedidos SET items_resumen = %s WHERE id = %s AND items_resumen IS NULL",
+        (items, pedido_id)
+    )
+    cur.connection.commit()
+    return items
+
 @app.get("/cart/pedidos/{pedido_id}")
 def obtener_pedido(pedido_id: int):
-    """Obtiene los detalles de un pedido específico"""
+    """Obtiene los detalles de un pedido con una sola lectura por clave primaria"""
     try:
         with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Obtener información del pedido
+            with conn.cursor() as cur:
+                psycopg2.extensions.register_type(DECIMAL_A_FLOAT, cur)
+                # Cabecera e items materializados en la misma fila, sin JOIN a productos
                 cur.execute(
                     """
-                    SELECT id, cliente_nombre, cliente_email, total, estado, fecha
+                    SELECT id, cliente_nombre, cliente_email, total, estado, motivo, fecha, items_resumen::text
                     FROM pedidos
                     WHERE id = %s
                     """,
@@ -215,6 +1014,11 @@ def obtener_pedido(pedido_id: int):
                 )
                 
                 pedido = cur.fetchone()
+                columnas_pedido = [col.name for col in cur.description][:-1]
+                
+                if not pedido and pedido_pendiente(pedido_id):
+                    # Encolado y todavía sin confirmar por el worker
+                    return respuesta_json({"pedido": {"id": pedido_id, "estado": "pendiente"}, "items": []})
                 
                 if not pedido:
                     raise HTTPException(
@@ -222,28 +1026,16 @@ def obtener_pedido(pedido_id: int):
                         detail=f"Pedido con ID {pedido_id} no encontrado"
                     )
                 
-                # Obtener items del pedido
-                cur.execute(
-                    """
-                    SELECT 
-                        pi.producto_id,
-                        p.nombre as producto_nombre,
-                        pi.cantidad,
-                        pi.precio_unitario,
-                        pi.subtotal
-                    FROM pedido_items pi
-                    JOIN productos p ON pi.producto_id = p.id
-                    WHERE pi.pedido_id = %s
-                    """,
-                    (pedido_id,)
-                )
+                *cabecera, items = pedido
+                if items is None:
+                    # Pedido creado antes de materializar los items
+                    items = materializar_items(cur, pedido_id)
                 
-                items = cur.fetchall()
-                
-                return {
-                    "pedido": pedido,
-                    "items": items
-                }
+                # Los items ya están en JSON: se insertan en la respuesta sin volver a parsearlos
+                return respuesta_json({
+                    "pedido": dict(zip(columnas_pedido, cabecera)),
+                    "items": orjson.Fragment(items)
+                })
                 
     except HTTPException:
         raise
@@ -253,25 +1045,79 @@ def obtener_pedido(pedido_id: int):
             detail=f"Error al obtener el pedido: {str(e)}"
         )
 
+# Columnas que se pueden pedir con fields=
+CAMPOS_PEDIDO = ("id", "cliente_nombre", "cliente_email", "total", "estado", "fecha")
+
+def codificar_cursor(valores: list) -> str:
+    """Cursor opaco a partir de los valores de la clave de orden de la última fila"""
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> list:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 @app.get("/cart/pedidos")
-def listar_pedidos(limite: int = 50):
-    """Lista los últimos pedidos"""
+def listar_pedidos(
+    limite: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """Lista los últimos pedidos paginando por (fecha, id) descendente"""
     try:
+        campos = list(CAMPOS_PEDIDO)
+        if fields:
+            campos = [campo.strip() for campo in fields.split(",") if campo.strip()]
+            invalidos = [campo for campo in campos if campo not in CAMPOS_PEDIDO]
+            if invalidos or not campos:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Campos inválidos: {', '.join(invalidos)}. Permitidos: {', '.join(CAMPOS_PEDIDO)}"
+                )
+        
+        # fecha e id siempre se consultan porque forman el cursor; los nombres vienen de CAMPOS_PEDIDO
+        columnas = list(dict.fromkeys(["fecha", "id"] + campos))
+        where = ""
+        parametros = []
+        if cursor:
+            try:
+                fecha, ultimo_id = decodificar_cursor(cursor)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Cursor inválido")
+            where = "WHERE (fecha, id) < (%s::timestamp, %s)"
+            parametros = [fecha, ultimo_id]
+        
         with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            with conn.cursor() as cur:
+                psycopg2.extensions.register_type(DECIMAL_A_FLOAT, cur)
                 cur.execute(
-                    """
-                    SELECT id, cliente_nombre, cliente_email, total, estado, fecha
+                    f"""
+                    SELECT {', '.join(columnas)}
                     FROM pedidos
-                    ORDER BY fecha DESC
+                    {where}
+                    ORDER BY fecha DESC, id DESC
                     LIMIT %s
                     """,
-                    (limite,)
+                    parametros + [limite + 1]
                 )
                 
                 pedidos = cur.fetchall()
-                return {"pedidos": pedidos}
+        
+        siguiente = None
+        if len(pedidos) > limite:
+            pedidos = pedidos[:limite]
+            # columnas empieza por fecha, id
+            siguiente = codificar_cursor([pedidos[-1][0].isoformat(), pedidos[-1][1]])
+        
+        posiciones = [columnas.index(campo) for campo in campos]
+        return respuesta_json({
+            "pedidos": [{campo: pedido[i] for campo, i in zip(campos, posiciones)} for pedido in pedidos],
+            "siguiente_cursor": siguiente
+        })
                 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -0,0 +1,92 @@
+"""Métricas Prometheus del servicio de pedidos (GET /metrics)"""
+import os
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+LATENCIA_HTTP = Histogram(
+    "http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por ruta",
+    ["metodo", "ruta", "estado"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+LATENCIA_ETAPA = Histogram(
+    "etapa_duration_seconds",
+    "Tiempo de cada etapa de una petición",
+    ["etapa"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+# Sin pool: cada petición abre su conexión, así que esto es lo que se consume de max_connections
+# Con varios workers se suman las de los procesos vivos
+CONEXIONES_ABIERTAS = Gauge(
+    "db_conexiones_abiertas", "Conexiones a PostgreSQL abiertas por el proceso", multiprocess_mode="livesum"
+)
+
+_ETAPAS = {
+    etapa: LATENCIA_ETAPA.labels(etapa)
+    for etapa in ("db_conexion", "db_consulta", "redis", "serializacion")
+}
+_CONSULTA = _ETAPAS["db_consulta"]
+
+
+@contextmanager
+def medir(etapa: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _ETAPAS[etapa].observe(time.perf_counter() - inicio)
+
+
+class CursorMedido(psycopg2.extensions.cursor):
+    """Cursor que registra el tiempo de cada execute"""
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _CONSULTA.observe(time.perf_counter() - inicio)
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mide cada petición con la plantilla de la ruta como label"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = scope.get("route")
+            LATENCIA_HTTP.labels(
+                scope["method"], ruta.path if ruta is not None else "sin_ruta", str(estado)
+            ).observe(time.perf_counter() - inicio)
+
+
+def respuesta_metricas():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Con varios workers (gunicorn.conf.py) se suman los archivos que escribe cada proceso
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), CONTENT_TYPE_LATEST
@@ -0,0 +1,113 @@
+"""Logging estructurado del servicio de pedidos: una línea JSON por evento, sin bloquear peticiones
+
+Los handlers solo encolan el registro; un hilo aparte lo formatea y lo escribe en stdout. Cada línea
+lleva el request_id de la petición (cabecera X-Request-ID que genera nginx) para correlacionarla con
+el access log del proxy, con service1 y con el worker que confirma el pedido encolado.
+"""
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import uuid
+from datetime import datetime, timezone
+
+import orjson
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Registros pendientes de escribir; si stdout no da abasto se descartan en lugar de frenar la petición
+LOG_COLA = int(os.getenv("LOG_COLA", "10000"))
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class FormatoJSON(logging.Formatter):
+    """Serializa el registro con orjson; los campos extra se pasan en extra={"campos": {...}}"""
+
+    def __init__(self, servicio: str):
+        super().__init__()
+        self.servicio = servicio
+
+    def format(self, record):
+        evento = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "servicio": self.servicio,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            evento["request_id"] = rid
+        campos = getattr(record, "campos", None)
+        if campos:
+            evento.update(campos)
+        if record.exc_info:
+            evento["error"] = self.formatException(record.exc_info)
+        return orjson.dumps(evento, default=str).decode()
+
+
+class ColaNoBloqueante(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea en el hilo de la petición y descarta si la cola está llena"""
+
+    descartados = 0
+
+    def prepare(self, record):
+        # El formato lo hace el hilo del listener; aquí solo se captura el contexto de la petición
+        record.request_id = request_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def configurar_logging(servicio: str):
+    """Instala el handler con cola en el logger raíz (una sola vez por proceso)"""
+    raiz = logging.getLogger()
+    if any(isinstance(handler, ColaNoBloqueante) for handler in raiz.handlers):
+        return
+    cola = queue.Queue(LOG_COLA)
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoJSON(servicio))
+    listener = logging.handlers.QueueListener(cola, salida)
+    raiz.addHandler(ColaNoBloqueante(cola))
+    raiz.setLevel(LOG_LEVEL)
+    listener.start()
+    # Vacía la cola al terminar el proceso
+    atexit.register(listener.stop)
+
+
+class MiddlewareRequestId:
+    """Middleware ASGI que toma X-Request-ID (o genera uno), lo deja en el contexto y lo devuelve"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rid = None
+        for nombre, valor in scope["headers"]:
+            if nombre == b"x-request-id":
+                rid = valor.decode("latin-1")[:128]
+                break
+        rid = rid or uuid.uuid4().hex
+        scope["request_id"] = rid
+        cabecera = (b"x-request-id", rid.encode("latin-1"))
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje["headers"] = [*mensaje.get("headers", []), cabecera]
+            await send(mensaje)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            request_id.reset(token)
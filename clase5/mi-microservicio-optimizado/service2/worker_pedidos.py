@@ -0,0 +1,184 @@
+"""Workers del checkout en cola: consumen el stream de pedidos y los confirman por lotes
+
+Cada proceso lee hasta CHECKOUT_LOTE pedidos del grupo de consumidores, los registra en una sola
+transacción (un savepoint por pedido) y recién después del commit los confirma en el stream.
+
+    python worker_pedidos.py
+"""
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+from registro import configurar_logging, request_id
+
+CHECKOUT_WORKERS = int(os.getenv("CHECKOUT_WORKERS", "2"))
+CHECKOUT_LOTE = int(os.getenv("CHECKOUT_LOTE", "50"))
+CHECKOUT_ESPERA_MS = int(os.getenv("CHECKOUT_ESPERA_MS", "1000"))
+# Mensajes entregados a un worker caído se reclaman después de este tiempo sin confirmar
+CHECKOUT_RECLAMAR_MS = int(os.getenv("CHECKOUT_RECLAMAR_MS", "60000"))
+
+log = logging.getLogger("worker_pedidos")
+
+
+def crear_grupo(main):
+    try:
+        # Desde "0" para no perder pedidos encolados antes de que arranque el primer worker
+        main.redis_client.xgroup_create(main.STREAM_PEDIDOS, main.GRUPO_PEDIDOS, id="0", mkstream=True)
+    except main.redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def agrupar_cantidades(carrito) -> dict:
+    cantidades = {}
+    for item in carrito.items:
+        cantidades[item.producto_id] = cantidades.get(item.producto_id, 0) + item.cantidad
+    return cantidades
+
+
+def rechazar_pedido(main, cur, pedido_id: int, carrito, motivo: str):
+    """Registra el rechazo dentro del savepoint del pedido; si tampoco se puede, el pedido se descarta"""
+    # Recortados al largo de las columnas: el rechazo no puede fallar por el mismo valor que rechazó al pedido
+    largo = main.CLIENTE_MAX_LARGO
+    try:
+        cur.execute(
+            """
+            INSERT INTO pedidos (id, cliente_nombre, cliente_email, total, estado, motivo, items_resumen, fecha)
+            VALUES (%s, %s, %s, 0, 'rechazado', %s, '[]', NOW())
+            ON CONFLICT (id) DO NOTHING
+            """,
+            (pedido_id, carrito.cliente_nombre.strip()[:largo], carrito.cliente_email.strip()[:largo], motivo)
+        )
+        log.info("Pedido rechazado", extra={"campos": {"pedido_id": pedido_id, "motivo": motivo}})
+    except main.psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT pedido")
+        log.error("Pedido %s descartado, no se pudo registrar el rechazo: %s", pedido_id, e)
+
+
+def procesar_lote(main, conn, mensajes) -> set:
+    """Registra los pedidos del lote en una transacción; devuelve los productos con stock modificado"""
+    productos = set()
+    with conn.cursor() as cur:
+        for _, datos in mensajes:
+            pedido_id = int(datos["pedido_id"])
+            # Los logs del pedido llevan el request_id de la petición que lo encoló
+            request_id.set(datos.get("request_id") or None)
+            try:
+                carrito = main.CarritoCreate.model_validate_json(datos["carrito"])
+            except ValueError as e:
+                # Mensaje corrupto: se descarta con el lote para que no bloquee la cola
+                log.error("Pedido %s descartado, carrito inválido: %s", pedido_id, e)
+                continue
+
+            # Reentrega de un lote que ya se confirmó en la base pero no en el stream
+            cur.execute("SELECT 1 FROM pedidos WHERE id = %s", (pedido_id,))
+            if cur.fetchone():
+                continue
+
+            cantidades = agrupar_cantidades(carrito)
+            for intento in range(1, main.CHECKOUT_REINTENTOS + 1):
+                cur.execute("SAVEPOINT pedido")
+                try:
+                    _, total = main.registrar_pedido(cur, carrito, cantidades, pedido_id=pedido_id, estado="confirmado")
+                    cur.execute("RELEASE SAVEPOINT pedido")
+                    productos.update(cantidades)
+                    log.info("Pedido confirmado", extra={"campos": {"pedido_id": pedido_id, "total": float(total)}})
+                    break
+                except main.HTTPException as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT pedido")
+                    rechazar_pedido(main, cur, pedido_id, carrito, str(e.detail))
+                    break
+                except main.psycopg2.OperationalError as e:
+                    # Deadlock, timeout de lock, etc.: solo se pierde el trabajo de este pedido y se reintenta
+                    cur.execute("ROLLBACK TO SAVEPOINT pedido")
+                    if intento == main.CHECKOUT_REINTENTOS:
+                        raise
+                    log.warning("Reintentando pedido %s (%d/%d): %s", pedido_id, intento, main.CHECKOUT_REINTENTOS, e)
+                except main.psycopg2.Error as e:
+                    # Error de datos del pedido (valor demasiado largo, total fuera de rango...): reintentarlo
+                    # fallaría igual y arrastraría al lote entero, así que se rechaza solo este pedido
+                    cur.execute("ROLLBACK TO SAVEPOINT pedido")
+                    motivo = e.diag.message_primary or str(e).strip()
+                    rechazar_pedido(main, cur, pedido_id, carrito, f"Error al registrar el pedido: {motivo}")
+                    break
+    request_id.set(None)
+    conn.commit()
+    return productos
+
+
+def confirmar_en_stream(main, mensajes):
+    ids = [mensaje_id for mensaje_id, _ in mensajes]
+    pipe = main.redis_client.pipeline(transaction=False)
+    pipe.xack(main.STREAM_PEDIDOS, main.GRUPO_PEDIDOS, *ids)
+    pipe.xdel(main.STREAM_PEDIDOS, *ids)
+    pipe.delete(*[f"pedido:pendiente:{datos['pedido_id']}" for _, datos in mensajes])
+    pipe.execute()
+
+
+def leer_mensajes(main, consumidor: str):
+    """Primero reclama los pedidos abandonados por otro worker; si no hay, espera pedidos nuevos"""
+    reclamados = main.redis_client.xautoclaim(
+        main.STREAM_PEDIDOS, main.GRUPO_PEDIDOS, consumidor,
+        min_idle_time=CHECKOUT_RECLAMAR_MS, start_id="0-0", count=CHECKOUT_LOTE
+    )
+    mensajes = [mensaje for mensaje in reclamados[1] if mensaje[1]]
+    if mensajes:
+        return mensajes
+    respuesta = main.redis_client.xreadgroup(
+        main.GRUPO_PEDIDOS, consumidor, {main.STREAM_PEDIDOS: ">"},
+        count=CHECKOUT_LOTE, block=CHECKOUT_ESPERA_MS
+    )
+    return respuesta[0][1] if respuesta else []
+
+
+def ejecutar_worker(numero: int):
+    # Se importa dentro del proceso hijo para que cada worker cree sus propios clientes
+    import main
+    main.conectar_redis()
+
+    if not main.redis_client:
+        raise SystemExit("✗ El worker de pedidos necesita Redis")
+    consumidor = f"{socket.gethostname()}-{numero}-{os.getpid()}"
+    crear_grupo(main)
+    log.info("Worker de pedidos %s escuchando %s", consumidor, main.STREAM_PEDIDOS)
+
+    conn = None
+    while True:
+        try:
+            mensajes = leer_mensajes(main, consumidor)
+            if not mensajes:
+                continue
+            if conn is None or conn.closed:
+                conn = main.psycopg2.connect(**main.DB_CONFIG)
+            try:
+                productos = procesar_lote(main, conn, mensajes)
+            except Exception:
+                conn.rollback()
+                raise
+            # El stock se descontó directo en la base: los contadores de la reserva en Redis quedaron viejos
+            main.borrar_contadores_stock(sorted(productos))
+            confirmar_en_stream(main, mensajes)
+            if productos:
+                # Una sola invalidación de cache por lote
+                main.invalidar_cache_productos(sorted(productos))
+        except (main.redis.RedisError, main.psycopg2.Error) as e:
+            # Los mensajes sin confirmar quedan pendientes y se reclaman más tarde
+            log.error("Error en el worker de pedidos %s: %s", consumidor, e)
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    configurar_logging("pedidos")
+    contexto = multiprocessing.get_context("spawn")
+    procesos = {}
+    while True:
+        for numero in range(CHECKOUT_WORKERS):
+            proceso = procesos.get(numero)
+            if proceso is None or not proceso.is_alive():
+                if proceso is not None:
+                    log.error("Worker %d terminó con código %s, reiniciando", numero, proceso.exitcode)
+                procesos[numero] = proceso = contexto.Process(target=ejecutar_worker, args=(numero,), daemon=True)
+                proceso.start()
+        time.sleep(2)